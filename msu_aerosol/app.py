@@ -5,12 +5,13 @@ from waitress import serve
 
 from msu_aerosol import config
 from msu_aerosol.admin import init_admin, init_schedule
-from msu_aerosol.commands import create_superuser
+from msu_aerosol.commands import create_superuser, migrate_storage
+from msu_aerosol.graph_funcs import start_refresh_pool
 from msu_aerosol.models import db
 from views.about import About
 from views.archive import Archive, DeviceArchive
 from views.contacts import ACContacts, DevelopersContacts
-from views.graph import GraphDownload, GraphPage
+from views.graph import GraphData, GraphDownload, GraphPage
 from views.homepage import Home, UpdateIndex
 from views.users import Login, Logout, Profile, Register
 
@@ -22,7 +23,10 @@ app: Flask = config.initialize_flask_app(__name__)
 
 # Настройка приложения
 app.cli.add_command(create_superuser)
+app.cli.add_command(migrate_storage)
 
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logging.getLogger('msu_aerosol').setLevel(config.log_level)
 logging.getLogger('waitress.queue').disabled = True
 
 # Связь URL адресов с классами их представления
@@ -54,6 +58,10 @@ app.add_url_rule(
     '/graphs/<int:graph_id>',
     view_func=GraphPage.as_view('graph'),
 )
+app.add_url_rule(
+    '/graphs/<int:graph_id>/data',
+    view_func=GraphData.as_view('graph_data'),
+)
 app.add_url_rule(
     '/graphs/<int:graph_id>/download',
     view_func=GraphDownload.as_view('graph_download'),
@@ -84,6 +92,8 @@ with app.app_context():
     db.init_app(app)
     db.create_all()
     init_admin(app)
+    # Пул процессов создаётся до запуска scheduler и потоков сервера
+    start_refresh_pool(app)
     init_schedule(None, None, None, app=app)
 
 
@@ -0,0 +1,90 @@
+"""
+Сравнение скорости очистки строк исходного файла:
+прежний df.map по каждой ячейке и clean_columns по текстовым столбцам.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.clean_columns --rows 200000
+    python -m benchmarks.clean_columns --path "data/AE33 S1/2024_02_01.csv"
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from msu_aerosol.graph_funcs import clean_columns, read_raw_file_slow
+
+__all__: list = []
+
+
+def make_frame(rows: int, columns: int = 8) -> pd.DataFrame:
+    """
+    Датафрейм, похожий на прочитанный файл прибора: время - строка,
+    часть столбцов - числа, часть - строки с пробелами и запятыми
+    :param rows: число строк
+    :param columns: число столбцов с данными
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.random((rows, columns)) * 1000,
+        columns=[f'col_{i}' for i in range(columns)],
+    )
+    for column in df.columns[::2]:
+        df[column] = df[column].map(lambda x: f' {x:.3f} '.replace('.', ','))
+    df.insert(
+        0,
+        'time',
+        pd.date_range('2024-01-01', periods=rows, freq='1s').strftime(
+            ' %Y-%m-%d %H:%M:%S',
+        ),
+    )
+    return df
+
+
+def read_file(path: str) -> pd.DataFrame:
+    with read_raw_file_slow(path) as reader:
+        return pd.concat(reader, ignore_index=True)
+
+
+def legacy_clean(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Прежняя очистка строк и преобразование запятых при отрисовке
+    """
+    df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+    values = df.iloc[:, 1:]
+    object_cols = values.select_dtypes(include='object').columns
+    values[object_cols] = values[object_cols].replace(',', '.', regex=True)
+    df.iloc[:, 1:] = values
+    return df
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--path')
+    args = parser.parse_args()
+
+    df = read_file(args.path) if args.path else make_frame(args.rows)
+    time_col = df.columns[0]
+    started = time.perf_counter()
+    new_result = clean_columns(df, time_col)
+    new_time = time.perf_counter() - started
+    started = time.perf_counter()
+    old_result = legacy_clean(df)
+    old_time = time.perf_counter() - started
+    print(f'clean_columns: {new_time:.3f} с на {len(df)} строк')
+    print(f'прежняя очистка: {old_time:.3f} с')
+    print(f'ускорение: {old_time / new_time:.1f}x')
+    pd.testing.assert_series_equal(old_result[time_col], new_result[time_col])
+    # Столбцы, которые не удалось преобразовать в числа, остаются строками
+    for column in df.columns[1:]:
+        old_values, new_values = old_result[column], new_result[column]
+        if new_values.dtype.kind == 'f':
+            old_values = old_values.replace('', np.nan).astype(float)
+        pd.testing.assert_series_equal(old_values, new_values)
+    print('результаты совпадают')
+
+
+if __name__ == '__main__':
+    main()
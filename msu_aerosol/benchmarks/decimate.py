@@ -0,0 +1,81 @@
+"""
+Сравнение объёма полного графика без прореживания и с decimate
+и числа точек каждой линии.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.decimate --days 14 --columns 3
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+from msu_aerosol.graph_funcs import decimate
+
+__all__: list = []
+
+
+def make_frame(days: int, columns: int) -> pd.DataFrame:
+    """
+    Данные прибора с частотой 1 Гц с редкими выбросами и одним разрывом
+    :param days: число дней
+    :param columns: число столбцов с данными
+    """
+    rng = np.random.default_rng(0)
+    rows = days * 24 * 3600
+    values = rng.normal(100, 10, (rows, columns))
+    spikes = rng.integers(0, rows, 20)
+    values[spikes] *= 10
+    values[rows // 2] = np.nan
+    df = pd.DataFrame(values, columns=[f'col_{i}' for i in range(columns)])
+    df.insert(
+        0,
+        'timestamp',
+        pd.date_range('2024-01-01', periods=rows, freq='1s'),
+    )
+    return df
+
+
+def figure_size(traces: dict[str, pd.DataFrame]) -> int:
+    figure = {
+        'data': [
+            {
+                'type': 'scattergl',
+                'x': trace['timestamp'].to_numpy(),
+                'y': trace[column].to_numpy(),
+            }
+            for column, trace in traces.items()
+        ],
+    }
+    return len(pio.to_json(figure, validate=False))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--columns', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.days, args.columns)
+    columns = list(df.columns[1:])
+    started = time.perf_counter()
+    decimated = decimate(df, 'timestamp', columns)
+    decimate_time = time.perf_counter() - started
+    longest = max(len(i) for i in decimated.values())
+    print(f'decimate: {decimate_time:.3f} с, {len(df)} -> {longest} точек')
+    # Все выбросы и разрыв остаются на каждой линии
+    for column, trace in decimated.items():
+        assert trace[column].max() == df[column].max()
+        assert trace[column].isna().any()
+    old_size = figure_size({i: df[['timestamp', i]] for i in columns})
+    new_size = figure_size(decimated)
+    print(f'без прореживания: {old_size / 2**20:.1f} МБ')
+    print(f'с прореживанием: {new_size / 2**20:.2f} МБ')
+    print(f'уменьшение: {old_size / new_size:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Сравнение построения и сериализации графика через px.line с переименованием
+линий и через make_figure (словарь из массивов numpy) на приборе
+с 20 столбцами.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.figure_builder --columns 20 --rows 4000
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+from msu_aerosol.graph_funcs import make_figure
+
+__all__: list = []
+
+
+def make_graph(columns: int) -> SimpleNamespace:
+    """
+    Настройки графика в том виде, в котором их читает make_figure
+    :param columns: число столбцов с данными
+    """
+    return SimpleNamespace(
+        columns=[
+            SimpleNamespace(
+                name=f'BC{i}',
+                use=True,
+                coefficient=1 if i % 2 else 2,
+                color=f'#{i * 12:02x}0000',
+                default=i < 5,
+            )
+            for i in range(columns)
+        ],
+        time_columns=[SimpleNamespace(name='Datetime', use=True)],
+        device=SimpleNamespace(full_name='bench'),
+    )
+
+
+def px_figure(graph, df: pd.DataFrame, columns: list[str]) -> str:
+    """
+    Прежний способ: px.line и цикл по линиям и столбцам графика
+    """
+    fig = px.line(
+        df,
+        x='timestamp',
+        y=columns,
+        render_mode='webgl',
+        color_discrete_sequence=[i.color for i in graph.columns],
+    )
+    for trace in fig.data:
+        for i in graph.columns:
+            if i.name == trace['name']:
+                trace.name = (
+                    f'{i.name}'
+                    if i.coefficient == 1
+                    else f'{i.name} * {i.coefficient}'
+                )
+                trace.visible = True if i.default else 'legendonly'
+                break
+    fig.update_layout(title='bench', plot_bgcolor='white')
+    return fig.to_json()
+
+
+def direct_figure(graph, df: pd.DataFrame, columns: list[str], engine):
+    traces = {i: df[['timestamp', i]] for i in columns}
+    figure = make_figure(graph, traces, 'timestamp', 'scattergl', 14)
+    return pio.to_json(figure, validate=False, engine=engine)
+
+
+def measure(name: str, func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f'{name}: {elapsed * 1000:.1f} мс')
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    graph = make_graph(args.columns)
+    columns = [i.name for i in graph.columns]
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(500, 100, (args.rows, args.columns)),
+        columns=columns,
+    )
+    df.insert(
+        0,
+        'timestamp',
+        pd.date_range('2024-01-01', periods=args.rows, freq='1min'),
+    )
+    old = measure(
+        'px.line',
+        lambda: px_figure(graph, df, columns),
+        args.repeat,
+    )
+    for engine in ('json', 'orjson'):
+        try:
+            new = measure(
+                f'make_figure, {engine}',
+                lambda: direct_figure(graph, df, columns, engine),
+                args.repeat,
+            )
+        except ValueError:
+            print(f'make_figure, {engine}: пакет не установлен')
+            continue
+        print(f'ускорение: {old / new:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
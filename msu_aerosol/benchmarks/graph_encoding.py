@@ -0,0 +1,78 @@
+"""
+Сравнение объёма данных графика в текстовом json и с двоичными
+массивами (encode_typed_arrays), а также времени их разбора.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.graph_encoding --days 14 --columns 3
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+from msu_aerosol.graph_funcs import decimate, encode_typed_arrays
+
+__all__: list = []
+
+
+def make_figure(days: int, columns: int, freq: str):
+    """
+    Полный график прибора так, как он строится при отрисовке
+    :param days: число дней
+    :param columns: число столбцов с данными
+    :param freq: частота записей
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2024-01-01', periods=days * 24 * 60, freq='1min')
+    times = pd.date_range(times[0], times[-1], freq=freq)
+    df = pd.DataFrame(
+        rng.normal(500, 100, (len(times), columns)),
+        columns=[f'BC{i}' for i in range(columns)],
+    )
+    df.insert(0, 'timestamp', times)
+    traces = decimate(df, 'timestamp', list(df.columns[1:]))
+    return go.Figure(
+        [
+            go.Scattergl(x=trace['timestamp'], y=trace[column], name=column)
+            for column, trace in traces.items()
+        ],
+    )
+
+
+def measure(name: str, content: bytes) -> None:
+    started = time.perf_counter()
+    json.loads(content)
+    parse_time = time.perf_counter() - started
+    print(
+        f'{name}: {len(content) / 2**10:.0f} КБ, '
+        f'gzip {len(gzip.compress(content)) / 2**10:.0f} КБ, '
+        f'разбор {parse_time * 1000:.1f} мс',
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--columns', type=int, default=3)
+    parser.add_argument('--freq', default='1min')
+    args = parser.parse_args()
+
+    fig = make_figure(args.days, args.columns, args.freq)
+    text = fig.to_json().encode()
+    typed = json.dumps(
+        encode_typed_arrays(fig.to_plotly_json()),
+        cls=PlotlyJSONEncoder,
+    ).encode()
+    measure('json', text)
+    measure('двоичные массивы', typed)
+    print(f'уменьшение: {len(text) / len(typed):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Сравнение скорости proc_spaces с прежней реализацией на Python-цикле
+и пикового потребления памяти при удалении повторяющихся столбцов.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.proc_spaces --rows 1000000
+    python -m benchmarks.proc_spaces --rows 1000000 --memory
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from msu_aerosol.graph_funcs import drop_duplicate_columns, proc_spaces
+
+__all__: list = []
+
+
+def make_frame(rows: int, columns: int = 5) -> pd.DataFrame:
+    """
+    Датафрейм, похожий на секундные данные прибора с редкими разрывами
+    :param rows: число строк
+    :param columns: число столбцов с данными
+    """
+    rng = np.random.default_rng(0)
+    step = np.ones(rows, dtype='int64')
+    step[rng.random(rows) < 0.001] = 600
+    timestamps = pd.Timestamp('2024-01-01') + pd.to_timedelta(
+        np.cumsum(step),
+        unit='s',
+    )
+    df = pd.DataFrame(
+        rng.random((rows, columns)),
+        columns=[f'col_{i}' for i in range(columns)],
+    )
+    df.insert(0, 'timestamp', timestamps)
+    return df
+
+
+def legacy_proc_spaces(df: pd.DataFrame, time_col: str) -> pd.DataFrame:
+    """
+    Прежняя реализация proc_spaces
+    """
+    df = df.sort_values(by=time_col)
+    diff_mode = df[time_col].diff().mode().values[0] * 1.3
+    new_rows = []
+    for i in range(len(df) - 1):
+        diff = df.loc[i + 1, time_col] - df.loc[i, time_col]
+        if diff > diff_mode:
+            new_date1 = df.loc[i, time_col] + pd.Timedelta(seconds=1)
+            new_date2 = df.loc[i + 1, time_col] - pd.Timedelta(seconds=1)
+            new_rows.extend([{time_col: new_date1}, {time_col: new_date2}])
+    return pd.concat(
+        [df.T.drop_duplicates().T, pd.DataFrame(new_rows)],
+        ignore_index=True,
+    )
+
+
+def measure(func, df: pd.DataFrame) -> tuple[float, pd.DataFrame]:
+    started = time.perf_counter()
+    result = func(df, 'timestamp')
+    return time.perf_counter() - started, result
+
+
+def measure_peak_memory(func, df: pd.DataFrame) -> float:
+    """
+    Пиковый объём памяти в МБ, выделенной при вызове func(df)
+    """
+    tracemalloc.start()
+    func(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def compare_memory(df: pd.DataFrame) -> None:
+    frame_size = df.memory_usage(deep=True).sum() / 2**20
+    old_peak = measure_peak_memory(lambda x: x.T.drop_duplicates().T, df)
+    new_peak = measure_peak_memory(drop_duplicate_columns, df)
+    print(f'размер датафрейма: {frame_size:.1f} МБ')
+    print(f'пик памяти, транспонирование: {old_peak:.1f} МБ')
+    print(f'пик памяти, drop_duplicate_columns: {new_peak:.1f} МБ')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--memory', action='store_true')
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    if args.memory:
+        compare_memory(df)
+        return
+    new_time, new_result = measure(proc_spaces, df)
+    print(f'proc_spaces: {new_time:.2f} с на {args.rows} строк')
+    if args.skip_legacy:
+        return
+    old_time, old_result = measure(legacy_proc_spaces, df)
+    print(f'прежняя реализация: {old_time:.2f} с')
+    print(f'ускорение: {old_time / new_time:.1f}x')
+    pd.testing.assert_frame_equal(
+        old_result.astype(str),
+        new_result.astype(str),
+    )
+    print('результаты совпадают')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Сравнение чтения данных прибора и построения графика по исходным
+разделам и по уровню агрегации, выбранному choose_level.
+
+Запуск из папки msu_aerosol:
+    python -m benchmarks.rollups --days 365 --storage npy
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from msu_aerosol.config import render_points
+from msu_aerosol.rollups import (
+    choose_level,
+    read_rollup,
+    sampling_step,
+    update_rollups,
+)
+from msu_aerosol.storage import storages
+
+__all__: list = []
+
+
+def fill_storage(storage, days: int, columns: int) -> pd.Timestamp:
+    """
+    Запись минутных данных прибора по разделам-месяцам
+    :param storage: хранилище
+    :param days: число дней
+    :param columns: число столбцов с данными
+    :return: последняя дата данных
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2024-01-01', periods=days * 24 * 60, freq='1min')
+    df = pd.DataFrame(
+        rng.random((len(times), columns)) * 1000,
+        columns=[f'col_{i}' for i in range(columns)],
+    )
+    df.insert(0, 'timestamp', times)
+    for partition, df_month in df.groupby(times.strftime('%Y_%m')):
+        storage.write('bench', partition, df_month)
+    return times[-1]
+
+
+def render(df: pd.DataFrame) -> float:
+    started = time.perf_counter()
+    px.line(df, x='timestamp', y=list(df.columns[1:])).to_json()
+    return time.perf_counter() - started
+
+
+def measure(storage, begin: pd.Timestamp, end: pd.Timestamp) -> None:
+    started = time.perf_counter()
+    raw = storage.read_range('bench', begin, end)
+    raw_time = time.perf_counter() - started
+    level = choose_level(
+        begin,
+        end,
+        render_points,
+        sampling_step('bench', storage),
+    )
+    started = time.perf_counter()
+    if level:
+        df = read_rollup('bench', level, begin, end, storage)
+    else:
+        df = storage.read_range('bench', begin, end)
+    level_time = time.perf_counter() - started
+    print(
+        f'{(end - begin).days} дн.: исходные {len(raw)} строк - '
+        f'чтение {raw_time:.3f} с, график {render(raw):.2f} с; '
+        f'уровень {level or "исходный"} {len(df)} строк - '
+        f'чтение {level_time:.3f} с, график {render(df):.2f} с',
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--columns', type=int, default=5)
+    parser.add_argument('--storage', default='csv', choices=storages)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = storages[args.storage](tmp)
+        end = fill_storage(storage, args.days, args.columns)
+        started = time.perf_counter()
+        update_rollups('bench', storage)
+        print(f'построение уровней: {time.perf_counter() - started:.2f} с')
+        measure(storage, end - pd.Timedelta(days=2), end)
+        measure(storage, end - pd.Timedelta(days=args.days), end)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
 import asyncio
 import atexit
-import csv
 import os
 from pathlib import Path
 import shutil
-from typing import Type
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask, request
@@ -13,25 +11,34 @@ from flask_admin import AdminIndexView, BaseView, expose
 from flask_login import current_user, LoginManager
 from sqlalchemy.event import listens_for
 
+from msu_aerosol.config import (
+    poll_jitter,
+    poll_max_interval,
+    poll_min_interval,
+    sync_threads,
+)
 from msu_aerosol.exceptions import (
     ColumnsMatchError,
     TimeFormatError,
 )
 from msu_aerosol.graph_funcs import (
-    download_device_data,
-    download_last_modified_file,
+    detect_parse_settings,
     get_spaced_colors,
-    make_graph,
+    graph_data_path,
+    make_device_graphs,
     preprocess_device_data,
+    refresh_device,
 )
 from msu_aerosol.models import (
     Complex,
     ComplexView,
     db,
     Device,
+    DeviceStats,
     DeviceView,
     Graph,
     GraphView,
+    ParseSettings,
     Role,
     RoleFieldView,
     TimeColumn,
@@ -39,6 +46,7 @@ from msu_aerosol.models import (
     UserFieldView,
     VariableColumn,
 )
+from msu_aerosol.sync import download_device_data, SyncManifest
 
 __all__ = []
 
@@ -123,20 +131,8 @@ class AdminSettingsView(AdminIndexView):
             or request.form.getlist(f'{graph.name}_cb_def') != default_cols
             or request.form.get(f'datetime_format_{graph.name}')
             != graph.time_format
-            or not Path(
-                f'templates/'
-                f'includes/'
-                f'graphs/'
-                f'full/'
-                f'graph_{graph.name}.html',
-            ).exists()
-            or not Path(
-                f'templates/'
-                f'includes/'
-                f'graphs/'
-                f'recent/'
-                f'graph_{graph.name}.html',
-            ).exists()
+            or not graph_data_path(graph.name, 'full').exists()
+            or not graph_data_path(graph.name, 'recent').exists()
         )
 
     def recreate_device(self, full_name_reloaded: str) -> str:
@@ -161,6 +157,8 @@ class AdminSettingsView(AdminIndexView):
             TimeColumn.query.filter_by(graph_id=graph.id).delete()
 
         Graph.query.filter_by(device_id=dev_id).delete()
+        ParseSettings.query.filter_by(device_id=dev_id).delete()
+        DeviceStats.query.filter_by(device_id=dev_id).delete()
         new_device: Device = Device(
             id=dev_id,
             name=name,
@@ -221,6 +219,17 @@ class AdminSettingsView(AdminIndexView):
                     ):
                         changed.append(graph)
 
+                # Все графики проверяются до сохранения любого из них:
+                # иначе сохранённые графики не были бы пред обработаны,
+                # а при следующей отправке формы считались бы неизменными
+                for graph in changed:
+                    checkboxes = request.form.getlist(f'{graph.name}_cb')
+                    defaults = request.form.getlist(f'{graph.name}_cb_def')
+                    if not set(defaults).issubset(set(checkboxes)):
+                        return self.get_admin_template(
+                            error='Не совпадают списки столбцов.',
+                        )
+
                 for graph in changed:
                     checkboxes = request.form.getlist(f'{graph.name}_cb')
                     radio = request.form.get(f'{graph.name}_rb')
@@ -230,63 +239,65 @@ class AdminSettingsView(AdminIndexView):
                     )
                     colors = request.form.getlist(f'color_{graph.name}')
                     coefficients = request.form.getlist(f'coeff_{graph.name}')
-                    if set(defaults).issubset(set(checkboxes)):
-                        for col, color, cf in zip(
-                            VariableColumn.query.filter_by(
-                                graph_id=graph.id,
-                            ),
-                            colors,
-                            coefficients,
-                        ):
-                            col.use = col.name in checkboxes
-                            col.default = col.name in defaults
-                            col.color = color
-                            col.coefficient = cf
-
-                        for time_col in TimeColumn.query.filter_by(
+                    for col, color, cf in zip(
+                        VariableColumn.query.filter_by(
                             graph_id=graph.id,
-                        ):
-                            time_col.use = time_col.name == radio
-                        graph.time_format = time_format
-                        db.session.commit()
-                        try:
-                            full_name = (
-                                Device.query.filter_by(id=graph.device_id)
-                                .first()
-                                .full_name
-                            )
-                            preprocess_device_data(
-                                full_name,
-                                graph,
-                            )
-                            make_graph(graph, 'full')
-                            make_graph(graph, 'recent')
-
-                        except TimeFormatError:
-                            return self.get_admin_template(
-                                error='Формат времени не подходит под столбец',
-                            )
-
-                        except ColumnsMatchError:
-                            return self.get_admin_template(
-                                error='Обнаружено несовпадение столбцов',
-                            )
-
-                        except ValueError:
-                            return self.get_admin_template(
-                                error='Невозможно предобработать данные '
-                                'по выбранным столбцам',
-                            )
-
-                        except Exception as e:
-                            error = e.__class__.__name__
-                            return self.get_admin_template(
-                                error=f'Непредвиденная ошибка: {error}',
-                            )
-                    else:
-                        return self.get_admin_template(
-                            error='Не совпадают списки столбцов.',
+                        ),
+                        colors,
+                        coefficients,
+                    ):
+                        col.use = col.name in checkboxes
+                        col.default = col.name in defaults
+                        col.color = color
+                        col.coefficient = cf
+
+                    for time_col in TimeColumn.query.filter_by(
+                        graph_id=graph.id,
+                    ):
+                        time_col.use = time_col.name == radio
+                    graph.time_format = time_format
+                    db.session.commit()
+
+                # Данные прибора пред обрабатываются один раз
+                # для всех его изменённых графиков (в разделы пишутся
+                # столбцы всех графиков прибора), затем графики отрисовываются
+                device_graphs: dict[int, list[Graph]] = {}
+                for graph in changed:
+                    device_graphs.setdefault(graph.device_id, []).append(graph)
+                try:
+                    for device_id, graphs in device_graphs.items():
+                        full_name = (
+                            Device.query.filter_by(id=device_id)
+                            .first()
+                            .full_name
+                        )
+                        preprocess_device_data(
+                            full_name,
+                            graphs[0],
                         )
+                        make_device_graphs(graphs)
+
+                except TimeFormatError:
+                    return self.get_admin_template(
+                        error='Формат времени не подходит под столбец',
+                    )
+
+                except ColumnsMatchError:
+                    return self.get_admin_template(
+                        error='Обнаружено несовпадение столбцов',
+                    )
+
+                except ValueError:
+                    return self.get_admin_template(
+                        error='Невозможно предобработать данные '
+                        'по выбранным столбцам',
+                    )
+
+                except Exception as e:
+                    error = e.__class__.__name__
+                    return self.get_admin_template(
+                        error=f'Непредвиденная ошибка: {error}',
+                    )
 
                 for graph in all_graphs:
                     device = Device.query.filter_by(id=graph.device_id).first()
@@ -334,42 +345,39 @@ def get_complexes_dict() -> dict[Complex, list[Device]]:
     }
 
 
-def csv_exists(path: str) -> bool:
-    return all(i.endswith('.csv') for i in os.listdir(path))
-
-
-def get_dialect(path: str) -> Type[csv.Dialect | csv.Dialect]:
+def get_device_header(device_id: int, full_name: str) -> list[str]:
     """
-    Функция, возвращающая разделитель в csv файле.
+    Функция, возвращающая заголовок исходных файлов прибора.
+    Заголовок определяется по началу первого файла прибора
+    и сохраняется вместе с параметрами чтения файлов.
 
-    :param path: Путь к csv файлу
-    :return: Разделитель в таблице
+    :param device_id: Идентификатор прибора
+    :param full_name: Полное название прибора
+    :return: Список названий столбцов
     """
 
-    with Path(path).open(
-        'r',
-        encoding='utf8' if csv_exists(str(Path(path).parent)) else 'latin',
-    ) as f:
-        return csv.Sniffer().sniff(f.readline())
+    settings = ParseSettings.query.filter_by(device_id=device_id).first()
+    if settings is None or settings.columns is None:
+        with os.scandir(f'data/{full_name}') as entries:
+            file = next(
+                i.name
+                for i in entries
+                if i.name.endswith('.csv') or i.name.endswith('.txt')
+            )
+        detected = detect_parse_settings(f'data/{full_name}/{file}')
+        if settings is None:
+            settings = ParseSettings(device_id=device_id, **detected)
+            db.session.add(settings)
+        else:
+            settings.columns = detected['columns']
+    return settings.columns
 
 
 def add_columns(graph: Graph, full_name=None) -> None:
     if not full_name:
         full_name = graph.device.full_name
-    file = [
-        x
-        for x in os.listdir(
-            f'data/{full_name}',
-        )
-        if x.endswith('.csv') or x.endswith('.txt')
-    ][0]
-    dialect = get_dialect(f'data/{full_name}/{file}')
-    with Path(f'data/{full_name}/{file}').open(
-        'r',
-        encoding='utf8' if csv_exists(f'data/{full_name}') else 'latin',
-    ) as csv_file:
-        header = list(csv.reader(csv_file, dialect=dialect))[0]
-        colors = get_spaced_colors(len(header))
+    header = get_device_header(graph.device_id, full_name)
+    colors = get_spaced_colors(len(header))
     for column, color in zip(header, colors):
         if 'time' in column.lower() or 'date' in column.lower():
             time_col = TimeColumn(
@@ -453,15 +461,12 @@ def remove_device_data(full_name: str) -> None:
     :return: None
     """
 
-    graph_full = f'templates/includes/graphs/full/graph_{full_name}.html'
-    graph_rec = f'templates/includes/graphs/recent/graph_{full_name}.html'
     proc_data = f'proc_data/{full_name}'
     data = f'data/{full_name}'
-    if Path(graph_full).exists():
-        Path(graph_full).unlink()
-
-    if Path(graph_rec).exists():
-        Path(graph_rec).unlink()
+    for spec_act in ('full', 'recent'):
+        graph_data = graph_data_path(full_name, spec_act)
+        graph_data.unlink(missing_ok=True)
+        graph_data.with_name(f'{graph_data.name}.gz').unlink(missing_ok=True)
 
     if Path(proc_data).exists():
         shutil.rmtree(proc_data)
@@ -469,6 +474,8 @@ def remove_device_data(full_name: str) -> None:
     if Path(data).exists():
         shutil.rmtree(data)
 
+    SyncManifest(full_name).remove()
+
 
 @listens_for(Device, 'after_delete')
 def after_delete(mapper, connection, target) -> None:
@@ -498,10 +505,78 @@ admin_settings: Admin = Admin(
 )
 
 login_manager: LoginManager = LoginManager()
-scheduler: BackgroundScheduler = BackgroundScheduler()
+scheduler: BackgroundScheduler = BackgroundScheduler(
+    executors={'default': {'type': 'threadpool', 'max_workers': sync_threads}},
+    job_defaults={'coalesce': True, 'max_instances': 1},
+)
 atexit.register(lambda: scheduler.shutdown())
 
 
+def get_poll_interval(
+    interval: float,
+    changed: bool,
+    upload_interval: float | None,
+    idle_time: float | None = None,
+) -> float:
+    """
+    Функция, подбирающая интервал опроса прибора под частоту его выгрузок.
+    Если за прошлый интервал прибор что-то выгрузил, интервал уменьшается
+    вдвое, иначе - увеличивается в полтора раза, но не больше,
+    чем обычный промежуток между файлами прибора в Я.Диске.
+    Если прибор молчит дольше обычного промежутка, ограничением служит
+    время с его последней выгрузки, поэтому переставшие выгружать
+    данные приборы опрашиваются всё реже.
+
+    :param interval: Текущий интервал опроса в секундах
+    :param changed: Появились ли у прибора новые данные
+    :param upload_interval: Промежуток между файлами прибора в секундах
+    :param idle_time: Время с последней выгрузки прибора в секундах
+    :return: Новый интервал опроса в секундах
+    """
+
+    upper = poll_max_interval
+    if upload_interval:
+        upper = min(
+            upper,
+            max(upload_interval, idle_time or 0, poll_min_interval),
+        )
+    interval = interval / 2 if changed else interval * 1.5
+    return max(poll_min_interval, min(interval, upper))
+
+
+def poll_device(device_id: int, full_name: str, link: str, app=None) -> None:
+    """
+    Задача scheduler, обновляющая один прибор
+    и подстраивающая интервал его следующего опроса.
+
+    :param device_id: Идентификатор прибора
+    :param full_name: Полное название прибора
+    :param link: Ссылка на данные прибора в Я.Диске
+    :param app: Объект приложения, нужный для обращения к БД через scheduler
+    :return: None
+    """
+
+    changed = refresh_device(full_name, link, app=app)
+    job = scheduler.get_job(f'downloader_{device_id}')
+    if not job:
+        return
+    interval = job.trigger.interval.total_seconds()
+    manifest = SyncManifest(full_name)
+    new_interval = get_poll_interval(
+        interval,
+        changed,
+        manifest.upload_interval(),
+        manifest.idle_time(),
+    )
+    if abs(new_interval - interval) >= 1:
+        scheduler.reschedule_job(
+            job.id,
+            trigger='interval',
+            seconds=new_interval,
+            jitter=poll_jitter,
+        )
+
+
 @listens_for(Device, 'after_insert')
 @listens_for(Device, 'after_delete')
 def init_schedule(mapper, connection, target, app=None) -> None:
@@ -510,6 +585,7 @@ def init_schedule(mapper, connection, target, app=None) -> None:
     добавлении записи в таблицу graphs.
     Перезапускает scheduler для избежания ошибок,
     связанных с обновлением несуществующих приборов.
+    Для каждого прибора заводится отдельная задача опроса.
 
     :param mapper: Необходимый аргумент для декоратора listens_for,
                    не используется в функции
@@ -521,23 +597,30 @@ def init_schedule(mapper, connection, target, app=None) -> None:
     :return: None
     """
 
-    global scheduler
     global application
     if app:
         application = app
-    name_to_link = {
-        i.full_name: i.link for i in Device.query.all() if i.show or i.archived
-    }
+    devices = [i for i in Device.query.all() if i.show or i.archived]
     if scheduler.running or not (mapper and connection and target):
         scheduler.remove_all_jobs()
-        scheduler.add_job(
-            func=download_last_modified_file,
-            trigger='interval',
-            seconds=120 * len(name_to_link.keys()),
-            id='downloader',
-            args=[name_to_link],
-            kwargs={'app': application},
-        )
+        # У каждого прибора своя задача: интервал опроса начинается
+        # с частоты выгрузок прибора и дальше подстраивается под неё
+        for device in devices:
+            upload_interval = SyncManifest(device.full_name).upload_interval()
+            scheduler.add_job(
+                func=poll_device,
+                trigger='interval',
+                seconds=min(
+                    max(upload_interval or 0, poll_min_interval),
+                    poll_max_interval,
+                ),
+                jitter=poll_jitter,
+                id=f'downloader_{device.id}',
+                args=[device.id, device.full_name, device.link],
+                kwargs={'app': application},
+                max_instances=1,
+                coalesce=True,
+            )
 
     if not scheduler.running:
         scheduler.start()
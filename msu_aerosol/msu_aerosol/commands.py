@@ -1,8 +1,11 @@
+from pathlib import Path
+
 import click
 from flask import Blueprint
 from werkzeug.security import generate_password_hash
 
 from msu_aerosol.models import db, Role, User
+from msu_aerosol.storage import get_storage, proc_data_path, storages
 
 __all__ = []
 
@@ -49,3 +52,48 @@ def create_superuser(login: str, email: str, password: str) -> None:
     db.session.commit()
 
     click.echo('Superuser created successfully.')
+
+
+@click.command('migratestorage')
+@click.option(
+    '--source',
+    type=click.Choice(list(storages)),
+    default='csv',
+    show_default=True,
+)
+@click.option(
+    '--target',
+    type=click.Choice(list(storages)),
+    default='npy',
+    show_default=True,
+)
+def migrate_storage(source: str, target: str) -> None:
+    """
+    Команда переноса пред обработанных данных в другое хранилище.
+    После переноса нужно указать новое хранилище в STORAGE_BACKEND.
+
+    :param source: Хранилище, из которого переносятся данные
+    :param target: Хранилище, в которое переносятся данные
+    :return: None
+    """
+
+    if source == target:
+        raise click.BadParameter('Хранилища должны различаться')
+    source_storage, target_storage = get_storage(source), get_storage(target)
+    if not Path(proc_data_path).exists():
+        return
+    for device_path in sorted(Path(proc_data_path).iterdir()):
+        partitions = source_storage.partitions(device_path.name)
+        for partition in partitions:
+            target_storage.write(
+                device_path.name,
+                partition,
+                source_storage.read(device_path.name, partition),
+            )
+            source_storage.remove(device_path.name, partition)
+
+        click.echo(
+            f'{device_path.name}: перенесено разделов - {len(partitions)}',
+        )
+
+    click.echo(f'Укажите STORAGE_BACKEND={target}')
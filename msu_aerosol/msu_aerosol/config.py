@@ -12,6 +12,28 @@ basedir = Path(os.path.dirname(__file__)).resolve().parent
 yadisk_token = os.getenv('YADISK_TOKEN', default='FAKE_TOKEN')
 upload_folder = 'received_data'
 allowed_extensions = ['csv', 'xlsx']
+# Максимальное число файлов, одновременно скачиваемых с Я.Диска
+download_concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', default=8))
+# Число потоков, одновременно синхронизирующих приборы с Я.Диском
+sync_threads = int(os.getenv('SYNC_THREADS', default=4))
+# Границы интервала опроса прибора в секундах и случайный сдвиг запуска
+poll_min_interval = int(os.getenv('POLL_MIN_INTERVAL', default=60))
+poll_max_interval = int(os.getenv('POLL_MAX_INTERVAL', default=3600))
+poll_jitter = int(os.getenv('POLL_JITTER', default=15))
+# Формат хранения пред обработанных данных: csv или npy
+storage_backend = os.getenv('STORAGE_BACKEND', default='csv')
+# Число строк исходного файла, одновременно обрабатываемых в памяти
+ingest_chunk_rows = int(os.getenv('INGEST_CHUNK_ROWS', default=100000))
+# Наибольшее число точек одной линии на полном графике
+render_points = int(os.getenv('RENDER_POINTS', default=4000))
+# Кодирование данных графиков: typed (двоичные массивы) или json (текст)
+graph_encoding = os.getenv('GRAPH_ENCODING', default='typed')
+# Уровень журнала приложения (прогресс загрузок пишется с уровнем INFO)
+log_level = os.getenv('LOG_LEVEL', default='INFO')
+# Число процессов для пред обработки данных и отрисовки графиков
+refresh_processes = int(
+    os.getenv('REFRESH_PROCESSES', default=os.cpu_count() or 1),
+)
 
 
 class Config:
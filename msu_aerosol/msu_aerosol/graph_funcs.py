@@ -1,27 +1,70 @@
-import asyncio
-from datetime import datetime, timedelta
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import csv
+from datetime import datetime, timedelta, timezone
+import gzip
 from io import BytesIO
 import json
+import logging
+import multiprocessing
 import os
 from pathlib import Path
+import re
+import threading
+from typing import Iterator
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.offline as offline
-from yadisk import AsyncYaDisk, YaDisk
-from yadisk.exceptions import InternalServerError, YaDiskConnectionError
+from pandas.io.parsers import TextFileReader
+from pandas.tseries.api import guess_datetime_format
+from pandas.util import hash_pandas_object
+import plotly.io as pio
+from sqlalchemy.orm import joinedload, selectinload, Session
 
-from msu_aerosol.config import yadisk_token
+from msu_aerosol.config import (
+    graph_encoding,
+    ingest_chunk_rows,
+    refresh_processes,
+    render_points,
+)
 from msu_aerosol.exceptions import ColumnsMatchError, TimeFormatError
-from msu_aerosol.models import Device, Graph, TimeColumn, VariableColumn
+from msu_aerosol.models import (
+    db,
+    Device,
+    DeviceStats,
+    Graph,
+    ParseSettings,
+    TimeColumn,
+)
+from msu_aerosol.rollups import (
+    choose_level,
+    read_rollup,
+    sampling_step,
+    update_rollups,
+)
+from msu_aerosol.storage import get_storage
+from msu_aerosol.sync import main_path, sync_device
 
 pd.set_option('future.no_silent_downcasting', True)
 
 __all__ = []
 
-main_path = 'data'
-disk_async = AsyncYaDisk(token=yadisk_token)
-disk_sync = YaDisk(token=yadisk_token)
+logger = logging.getLogger(__name__)
+# Пул процессов для пред обработки и отрисовки графиков
+refresh_pool: ProcessPoolExecutor | None = None
+refresh_pool_lock = threading.Lock()
+# Объект приложения Flask внутри процесса из пула
+refresh_app = None
+# Сколько дней данных считывается для отрисовки графика каждого вида
+render_windows = {'full': 15, 'recent': 3}
+# Сколько последних дней показывается на графике каждого вида
+shown_days = {'full': 14, 'recent': 2}
+# Форматы времени, с которыми удалось разобрать файлы графиков:
+# {(id графика, формат из настроек графика): формат для pd.to_datetime}
+resolved_time_formats: dict[tuple[int, str | None], str] = {}
+# Папка с данными отрисованных графиков
+graphs_path = 'graph_data'
 
 
 def get_device_by_name(name: str, app=None) -> Device | None:
@@ -65,131 +108,300 @@ def load_colors() -> list:
         return json.load(colors)
 
 
-def no_csv(link: str) -> bool | None:
+def init_refresh_worker(app) -> None:
     """
-    Функция, которая определяет, есть ли csv в полученных файлах прибора
-    :param link: ссылка, на данные прибора в Я.Диске
+    Инициализация процесса-обработчика из пула обновления графиков.
+    Процесс создаётся через fork, поэтому объект приложения
+    передаётся без сериализации.
+    :param app: объект приложения Flask
     """
+    global refresh_app
+    refresh_app = app
+    with app.app_context():
+        # Соединения с БД родительского процесса в дочернем не используются
+        db.engine.dispose(close=False)
 
-    try:
-        return all(
-            not i['name'].endswith('.csv')
-            for i in disk_sync.get_public_meta(link, limit=1000)['embedded'][
-                'items'
-            ]
+
+def start_refresh_pool(app) -> None:
+    """
+    Функция, запускающая пул процессов для пред обработки и отрисовки.
+    Вызывается один раз при старте приложения, до запуска scheduler
+    и потоков сервера: процессы создаются через fork, а fork процесса,
+    в котором уже работают другие потоки, может оставить дочерний процесс
+    с навсегда захваченной блокировкой (например, блокировкой журнала).
+    На Windows (где нет fork) пул не используется и обработка идёт
+    в текущем потоке.
+    :param app: объект приложения Flask
+    """
+    global refresh_pool
+    if os.name == 'nt':
+        return
+    with refresh_pool_lock:
+        if refresh_pool is not None:
+            return
+        refresh_pool = ProcessPoolExecutor(
+            max_workers=refresh_processes,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=init_refresh_worker,
+            initargs=(app,),
         )
+        # С fork все процессы пула создаются при первой задаче,
+        # поэтому она отправляется сразу, пока других потоков нет
+        refresh_pool.submit(os.getpid).result()
 
-    except InternalServerError:
-        return None
+
+def stop_refresh_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Функция, отключающая сломанный пул процессов. Новый пул не создаётся
+    (это был бы fork из процесса с потоками), и до перезапуска приложения
+    обработка идёт в текущем потоке
+    :param pool: сломанный пул
+    """
+    global refresh_pool
+    with refresh_pool_lock:
+        if refresh_pool is pool:
+            refresh_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
 
-def download_last_modified_file(name_to_link: dict[str:str], app=None) -> None:
+def update_device_graphs(full_name: str, paths: list[str], app=None) -> None:
     """
-    :param name_to_link: словарь, где ключ - имя прибора,
-    значение - ссылка на его данные в Я.Диске
+    Функция, пред обрабатывающая новые файлы прибора
+    и пересоздающая его графики. Каждый файл пред обрабатывается один раз
+    (в разделы пишутся столбцы всех графиков прибора),
+    а по каждому графику выполняется только отрисовка
+    :param full_name: имя прибора
+    :param paths: пути к новым файлам прибора
     :param app: объект приложения Flask
-    Функция, обновляющая последний измененный файл по каждому прибору
-    """
-    list_data_path = []
-    # Выбор последнего измененного файла по каждому прибору
-    for full_name, link in name_to_link.items():
-        # Объект последнего измененного файла по прибору
-        csv_not_exists = no_csv(link)
-        if csv_not_exists is not None:
-            last_modified_file = sorted(
-                filter(
-                    lambda y: y['name'].endswith(
-                        '.txt' if csv_not_exists else '.csv',
-                    ),
-                    disk_sync.get_public_meta(link, limit=1000)['embedded'][
-                        'items'
-                    ],
-                ),
-                key=lambda x: x['modified'],
-            )[-1]
-
+    """
+    dev = get_device_by_name(full_name, app)
+    if not dev.archived:  # Если не в архиве
+        # Графики используются и после выхода из вложенных контекстов
+        # приложения, поэтому всё нужное для отрисовки загружается сразу
+        query = Graph.query.options(
+            joinedload(Graph.device),
+            selectinload(Graph.columns),
+            selectinload(Graph.time_columns),
+        )
+        if app:
+            with app.app_context():
+                graphs = query.filter_by(device_id=dev.id).all()
         else:
+            graphs = query.filter_by(device_id=dev.id).all()
+        if not graphs:
             return
-        # Путь для сохранения исходного файла.
-        file_path = f'{main_path}/{full_name}/{last_modified_file["name"]}'
-        try:
-            disk_sync.download_by_link(
-                last_modified_file['file'],
-                file_path,
-            )
-        except YaDiskConnectionError:
-            return
-        list_data_path.append([full_name, file_path])
-    # Для каждого обновленного файла
-    for i in list_data_path:
-        dev = get_device_by_name(i[0], app)
-        if not dev.archived:  # Если не в архиве
-            try:
-                if app:
-                    with app.app_context():
-                        graphs = Graph.query.filter_by(device_id=dev.id)
-                else:
-                    graphs = Graph.query.filter_by(device_id=dev.id)
-                for j in graphs:
-                    # Пред обработка обновленного файла
-                    preprocessing_one_file(j, i[1], app=app)
-                    # Пересоздание полного графика
-                    make_graph(j, spec_act='full', app=app)
-                    # Пересоздание короткого графика
-                    make_graph(j, spec_act='recent', app=app)
-
-            except (KeyError, Exception):
-                ...
-
-
-async def download_file(full_name: str, element: dict) -> None:
-    """
-    Функция для скачивания файла из Я.Диска
-    :param full_name: имя прибора
-    :param element: Объект файла, который необходимо скачать
-    """
-    loop = asyncio.get_event_loop()
-    async with disk_async:
-        await loop.run_in_executor(
-            None,
-            disk_sync.download_by_link,
-            element['file'],
-            f'{main_path}/{full_name}/{element["name"]}',
+        # Время берётся из графика, у которого выбран временной столбец
+        main_graph = next(
+            (g for g in graphs if any(i.use for i in g.time_columns)),
+            graphs[0],
         )
+        # Пред обработка обновленных файлов
+        for path in paths:
+            preprocessing_one_file(main_graph, path, app=app)
+        # Пересоздание полных и коротких графиков
+        # по один раз считанным данным прибора
+        make_device_graphs(graphs, app=app)
 
 
-async def download_device_data(full_name: str, link: str) -> None:
+def update_device_graphs_in_worker(full_name: str, paths: list[str]) -> None:
     """
-    Функция для загрузки всех данных прибора на сервер с Я.Диска
+    Обёртка над update_device_graphs для запуска в пуле процессов
     :param full_name: имя прибора
-    :param link: ссылка на его Я.Диск
-    """
-    tasks: list = []
-    items = disk_sync.get_public_meta(link, limit=1000)
-    for i in items['embedded']['items']:
-        if not Path(f'{main_path}/{full_name}').exists():
-            Path(f'{main_path}/{full_name}').mkdir(parents=True)
-        if i['name'].endswith('.csv') or (
-            i['name'].endswith('.txt') and no_csv(link)
-        ):
-            tasks.append(download_file(full_name, i))
+    :param paths: пути к новым файлам прибора
+    """
+    with refresh_app.app_context():
+        update_device_graphs(full_name, paths, app=refresh_app)
+
+
+def refresh_device(full_name: str, link: str, app=None) -> bool:
+    """
+    Функция, обновляющая один прибор: скачивание новых файлов
+    выполняется в текущем потоке, пред обработка и отрисовка -
+    в пуле процессов
+    :param full_name: имя прибора
+    :param link: ссылка на его данные в Я.Диске
+    :param app: объект приложения Flask
+    :return: True, если у прибора появились новые или изменённые файлы
+    и они обработаны, False - если их нет или обновить прибор не удалось
+    """
+    pool = refresh_pool
+    try:
+        paths = sync_device(full_name, link)
+        if not paths:
+            return False
+        if pool is not None:
+            pool.submit(
+                update_device_graphs_in_worker,
+                full_name,
+                paths,
+            ).result()
+        else:
+            update_device_graphs(full_name, paths, app=app)
+
+    except BrokenProcessPool:
+        stop_refresh_pool(pool)
+        logger.exception('%s: пул процессов обновления сломан', full_name)
+        return False
+
+    except Exception:
+        logger.exception('%s: не удалось обновить прибор', full_name)
+        return False
+
+    return True
+
+
+def save_partition_frames(
+    frames: list[pd.DataFrame],
+    device_name: str,
+    partition: str,
+    columns: list[str],
+) -> None:
+    """
+    Функция, записывающая в раздел данные, собранные из нескольких файлов.
+    Повторяющиеся строки объединяются так же, как при поочерёдной
+    обработке файлов: значения из более позднего файла важнее
+    :param frames: данные раздела из файлов в порядке их обработки
+    :param device_name: название прибора
+    :param partition: название раздела
+    :param columns: столбцы раздела (первый из них - временной)
+    """
+    df_month = pd.concat(frames, ignore_index=True)
+    if df_month['timestamp'].duplicated().any():
+        df_month = df_month.groupby('timestamp', as_index=False).last()
+    save_month_partition(df_month, device_name, partition, columns)
+
+
+class PartitionBuffer:
+    """
+    Данные разделов, собранные из нескольких файлов при пакетной
+    пред обработке. Раздел записывается, как только пришли данные
+    более позднего месяца (файлы идут по времени), а все разделы -
+    как только в буфере набирается больше ingest_chunk_rows строк.
+    Если более поздний файл вернётся к записанному разделу, его данные
+    объединятся с разделом так же, как при поочерёдной обработке
+    """
+
+    def __init__(self, device_name: str, columns: list[str]) -> None:
+        self.device_name = device_name
+        self.columns = columns
+        self.partitions: dict[str, list[pd.DataFrame]] = {}
+        self.rows = 0
+
+    def add(self, month_frames: dict[str, pd.DataFrame]) -> None:
+        """
+        Добавление данных одного файла или одной его части.
 
-    await asyncio.gather(*tasks)
+        :param month_frames: словарь {название раздела: данные раздела}
+        """
+
+        if month_frames:
+            first = min(month_frames)
+            self.flush([i for i in self.partitions if i < first])
+        for partition, df_month in month_frames.items():
+            self.partitions.setdefault(partition, []).append(df_month)
+            self.rows += len(df_month)
+        if self.rows > ingest_chunk_rows:
+            self.flush()
+
+    def flush(self, partitions: list[str] | None = None) -> None:
+        """
+        Запись разделов из буфера в хранилище.
+
+        :param partitions: какие разделы записать (по умолчанию все)
+        """
+
+        if partitions is None:
+            partitions = list(self.partitions)
+        for partition in sorted(partitions):
+            frames = self.partitions.pop(partition)
+            self.rows -= sum(len(i) for i in frames)
+            save_partition_frames(
+                frames,
+                self.device_name,
+                partition,
+                self.columns,
+            )
 
 
 def preprocess_device_data(name_folder: str, graph: Graph, app=None) -> None:
     """
-    Функция для пред обработки всех файлов прибора
+    Функция для пред обработки всех файлов прибора.
+    Небольшие файлы разбираются одновременно в пуле процессов
+    (не больше чем на несколько файлов вперёд), а файлы больше
+    ingest_chunk_rows строк читаются частями в текущем процессе.
+    Данные собираются по разделам-месяцам в PartitionBuffer,
+    поэтому в памяти одновременно остаётся ограниченное число строк
     :param name_folder: имя папки, где лежат не пред обработанные файлы прибора
     :param graph: объект записи в БД из таблицы graphs
     :param app: объект приложения Flask
     """
-    for name_file in os.listdir(f'{main_path}/{name_folder}'):
-        preprocessing_one_file(
-            graph,
-            f'{main_path}/{name_folder}/{name_file}',
-            app=app,
-        )
+    paths = [
+        f'{main_path}/{name_folder}/{i}'
+        for i in sorted(os.listdir(f'{main_path}/{name_folder}'))
+    ]
+    if not paths:
+        return
+    if app:
+        with app.app_context():
+            device = Device.query.filter_by(id=graph.device_id).first()
+            settings = get_parse_settings(device, paths[0])
+            spec = make_ingest_spec(graph, device, settings)
+    else:
+        device = Device.query.filter_by(id=graph.device_id).first()
+        settings = get_parse_settings(device, paths[0])
+        spec = make_ingest_spec(graph, device, settings)
+    buffer = PartitionBuffer(device.name, ['timestamp'] + spec['res'][1:])
+    # Внутри процесса из пула файлы разбираются в нём же
+    pool = refresh_pool if refresh_app is None else None
+    large = {
+        i
+        for i, path in enumerate(paths)
+        if estimate_rows(path) > ingest_chunk_rows
+    }
+    futures = {}
+    any_slow = False
+    for i, path in enumerate(paths):
+        try:
+            if pool is not None and i not in large:
+                # Следующие небольшие файлы разбираются заранее,
+                # пока этот раскладывается по разделам
+                stop = i + 2 * refresh_processes
+                for j, later in enumerate(paths[i:stop], start=i):
+                    if j not in futures and j not in large:
+                        futures[j] = pool.submit(parse_raw_file, later, spec)
+                month_frames, slow = futures.pop(i).result()
+                any_slow = any_slow or slow
+                buffer.add(month_frames)
+                continue
+
+        except BrokenProcessPool:
+            # Оставшиеся файлы разбираются в текущем процессе
+            stop_refresh_pool(pool)
+            pool, futures = None, {}
+
+        except TimeFormatError:
+            if not app:
+                raise
+            continue
+
+        try:
+            for df, slow in iter_raw_file(path, spec):
+                any_slow = any_slow or slow
+                buffer.add(dict(split_by_month(df)))
+
+        except TimeFormatError:
+            if not app:
+                raise
+
+    if any_slow:
+        if app:
+            with app.app_context():
+                forget_parse_settings(device)
+        else:
+            forget_parse_settings(device)
+    buffer.flush()
+    update_rollups(device.name)
+    mark_device_stats(device.id, device.name, ingested=True, app=app)
 
 
 def get_time_col(graph: Graph) -> str:
@@ -207,177 +419,787 @@ def get_time_col(graph: Graph) -> str:
     )
 
 
-def proc_spaces(df: pd.DataFrame, time_col: str) -> pd.DataFrame:
+def drop_duplicate_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Функция, удаляющая столбцы, полностью совпадающие с одним из предыдущих.
+    Столбцы сравниваются по типу и хешу значений, поэлементно сравниваются
+    только столбцы с совпавшим хешем. Датафрейм не транспонируется,
+    поэтому типы столбцов сохраняются.
+    :param df: Датафрейм, в котором удаляются повторяющиеся столбцы
+    """
+    candidates: dict[tuple, list[int]] = {}
+    keep = []
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        key = (
+            column.dtype,
+            int(hash_pandas_object(column, index=False).sum()),
+        )
+        same = candidates.setdefault(key, [])
+        if any(column.equals(df.iloc[:, i]) for i in same):
+            continue
+        same.append(position)
+        keep.append(position)
+
+    if len(keep) == df.shape[1]:
+        return df
+    return df.iloc[:, keep]
+
+
+def proc_spaces(
+    df: pd.DataFrame,
+    time_col: str,
+    last_time: pd.Timestamp | None = None,
+) -> pd.DataFrame:
     """
     Функция, удаляющая пробелы между большими временными промежутками.
+    На месте каждого большого промежутка добавляются две пустые строки
+    (через секунду после его начала и за секунду до конца),
+    чтобы линия графика в этом месте разрывалась.
     :param df: Датафрейм, в котором удаляются промежутки
     :param time_col: временной столбец
+    :param last_time: последняя дата предыдущей части файла,
+    чтобы найти промежуток на стыке частей
     """
     df = df.sort_values(by=time_col)
+    times = df[time_col].reset_index(drop=True)
+    if last_time is not None:
+        times = pd.concat(
+            [pd.Series([last_time], dtype=times.dtype), times],
+            ignore_index=True,
+        )
+    if len(times) < 2:
+        return drop_duplicate_columns(df)
+    diffs = times.diff()
     # diff_mode - временной промежуток между соседними по времени строками,
     # после которого считается, что пробел большой
-    diff_mode = df[time_col].diff().mode().values[0] * 1.3
-    new_rows = []
-    for i in range(len(df) - 1):
-        diff = df.loc[i + 1, time_col] - df.loc[i, time_col]
-        if diff > diff_mode:
-            new_date1 = df.loc[i, time_col] + pd.Timedelta(seconds=1)
-            new_date2 = df.loc[i + 1, time_col] - pd.Timedelta(seconds=1)
-            new_row1 = {time_col: new_date1}
-            new_row2 = {time_col: new_date2}
-            new_rows.extend([new_row1, new_row2])
+    diff_mode = diffs.mode().values[0] * 1.3
+    gaps = (diffs > diff_mode).to_numpy()
+    second = pd.Timedelta(seconds=1)
+    starts = times.shift(1)[gaps].to_numpy() + second
+    ends = times[gaps].to_numpy() - second
+    new_rows = pd.DataFrame(
+        {time_col: np.column_stack([starts, ends]).ravel()},
+    )
     return pd.concat(
-        [df.T.drop_duplicates().T, pd.DataFrame(new_rows)],
+        [drop_duplicate_columns(df), new_rows],
         ignore_index=True,
     )
 
 
-def preprocessing_one_file(
-    graph: Graph,
-    path: str,
+def save_month_partition(
+    df_month: pd.DataFrame,
+    device_name: str,
+    partition: str,
+    columns: list[str],
     user_upload=False,
-    app=None,
 ) -> None:
     """
-    Функция для пред обработки файла прибора
-    :param graph: объект записи в БД из таблицы graphs
-    :param path: путь, по которому расположен исходный файл с данными.
+    Функция, сохраняющая данные одного месяца в хранилище.
+    Если новые данные начинаются позже последней записи в разделе,
+    они дописываются в его конец. Если же промежутки пересекаются,
+    данные объединяются с разделом и он перезаписывается целиком.
+    :param df_month: датафрейм с данными за один месяц
+    :param device_name: название прибора
+    :param partition: название раздела (год и месяц, например 2024_05)
+    :param columns: столбцы, которые сохраняются в раздел
+    (первый из них - временной)
     :param user_upload:
     Флаг, отображающий, загружает ли пользователь свои данные
-    :param app: Объект приложения Flask
     """
-    if app:
-        with app.app_context():
-            device = Device.query.filter_by(id=graph.device_id).first()
+    storage = get_storage()
+    time_col = columns[0]
+    exists = storage.exists(device_name, partition)
+    append = False
+    # Если раздел уже существовал ранее
+    if exists or user_upload:
+        header, last_date = storage.bounds(device_name, partition)
+        append = (
+            header == columns
+            and last_date is not None
+            and pd.to_datetime(df_month[time_col]).min() > last_date
+        )
+    if not append and (exists or user_upload):
+        df_help = storage.read(device_name, partition)
+        df_month.loc[:, time_col] = pd.to_datetime(
+            df_month.loc[:, time_col],
+        )
+        # Два датафрейма объединяются
+        result = pd.merge(df_month, df_help, on=time_col, how='outer')
+        for column in df_month.columns:
+            if column in df_help.columns and column != time_col:
+                result[column] = result[column + '_x'].fillna(
+                    result[column + '_y'],
+                )
+                result.drop(
+                    columns=[column + '_x', column + '_y'],
+                    inplace=True,
+                )
+        result.drop_duplicates()
+        df_month = result
+    if len(df_month) == 0:
+        return
+    df_month = df_month.sort_values(by=time_col).drop_duplicates(
+        subset=[time_col],
+    )
+    for column in columns:
+        if column not in df_month.columns:
+            df_month[column] = pd.NA
+    df_month = df_month[columns]
+    if append:
+        storage.append(device_name, partition, df_month)
     else:
-        device = Device.query.filter_by(id=graph.device_id).first()
-    # Считывание датафрейма из файла
+        storage.write(device_name, partition, df_month)
+
+
+def clean_columns(df: pd.DataFrame, time_col: str) -> pd.DataFrame:
+    """
+    Функция, очищающая текстовые столбцы исходного файла.
+    У строк удаляются пробелы по краям, а столбцы значений,
+    в которых все непустые значения - числа с десятичной запятой
+    или точкой, преобразуются в числа. Числовые столбцы не затрагиваются.
+    :param df: Датафрейм с данными исходного файла
+    :param time_col: временной столбец (он остаётся текстовым)
+    :return: Очищенный датафрейм
+    """
+    object_cols = df.select_dtypes(include='object').columns
+    if not len(object_cols):
+        return df
+    df = df.copy()
+    for column in object_cols:
+        values = df[column]
+        if column != time_col:
+            # Пробелы по краям чисел при преобразовании отбрасываются
+            commas_replaced = values.str.replace(',', '.', regex=False)
+            try:
+                df[column] = commas_replaced.astype(float)
+                continue
+
+            except (TypeError, ValueError):
+                numbers = pd.to_numeric(commas_replaced, errors='coerce')
+                present = values.notna() & values.str.strip().ne('')
+                if numbers[present].notna().all():
+                    df[column] = numbers
+                    continue
+
+        stripped = values.str.strip()
+        # Значения, которые не являются строками, остаются как есть
+        df[column] = stripped.where(stripped.notna(), values)
+
+    return df
+
+
+def parse_epoch(values: pd.Series) -> pd.Series:
+    """
+    Векторное преобразование времени unix в локальные даты,
+    совпадающее с datetime.fromtimestamp для каждого значения.
+    Единица измерения (секунды, миллисекунды, микросекунды
+    или наносекунды) определяется по величине чисел
+    :param values: столбец со временем unix
+    :return: столбец с датами
+    :raises ValueError: в столбце есть пустые или нечисловые значения
+    """
+    values = pd.to_numeric(values)
+    if values.isna().any():
+        raise ValueError('В столбце времени есть пустые значения')
+    numbers = values.to_numpy(dtype='float64')
+    magnitude = np.abs(numbers).max() if len(numbers) else 0
+    per_second = next(
+        i
+        for limit, i in ((1e11, 1), (1e14, 1e3), (1e17, 1e6), (np.inf, 1e9))
+        if magnitude < limit
+    )
+    if per_second == 1:
+        # Дробная часть секунд округляется так же, как в fromtimestamp
+        whole = np.trunc(numbers)
+        micro = whole * 1e6 + np.round((numbers - whole) * 1e6)
+    else:
+        micro = np.round(numbers * (1e6 / per_second))
+    # Смещение часового пояса вычисляется один раз на каждые 15 минут,
+    # поэтому переходы на летнее время учитываются
+    buckets, inverse = np.unique(np.floor(micro / 9e8), return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.fromtimestamp(i * 900, tz=timezone.utc)
+            .astimezone()
+            .utcoffset()
+            .total_seconds()
+            * 1e6
+            for i in buckets
+        ],
+    )
+    local = (micro + offsets[inverse]).astype('int64')
+    return pd.Series(
+        local.astype('datetime64[us]').astype('datetime64[ns]'),
+        index=values.index,
+    )
+
+
+def parse_time_column(
+    values: pd.Series,
+    graph_id: int,
+    time_format: str | None,
+) -> pd.Series:
+    """
+    Преобразование столбца времени в даты.
+    Сначала используется формат, уже подошедший для этого графика,
+    или формат из настроек графика. Если он не подходит,
+    формат определяется по первому значению столбца
+    и запоминается для следующих файлов.
+    :param values: столбец времени
+    :param graph_id: id графика
+    :param time_format: формат времени из настроек графика (d.m.Y H:M:S)
+    :return: столбец с датами
+    :raises ValueError: формат времени определить не удалось
+    """
+    key = (graph_id, time_format)
+    settings_format = time_format
+    time_format = resolved_time_formats.get(key)
+    if time_format is None and settings_format:
+        time_format = make_format_date(settings_format)
+    if time_format:
+        try:
+            times = pd.to_datetime(values, format=time_format)
+            resolved_time_formats[key] = time_format
+            return times
+
+        except (TypeError, ValueError):
+            pass
+
+    first = values.dropna()
+    if len(first):
+        first = str(first.iloc[0])
+        # Если год записан не первым, то день идёт перед месяцем
+        time_format = guess_datetime_format(
+            first,
+            dayfirst=not re.match(r'\d{4}', first),
+        )
+        if time_format:
+            try:
+                times = pd.to_datetime(values, format=time_format)
+                resolved_time_formats[key] = time_format
+                return times
+
+            except (TypeError, ValueError):
+                pass
+
+    raise ValueError('Не удалось определить формат времени')
+
+
+def detect_parse_settings(path: str, sample_size: int = 65536) -> dict:
+    """
+    Функция, определяющая параметры чтения исходного файла по его началу:
+    разделитель, десятичный разделитель, кодировку, номер строки заголовка
+    и сам заголовок. Читаются только первые sample_size байт файла
+    :param path: путь к исходному файлу
+    :param sample_size: сколько байт с начала файла читать
+    :return: словарь с параметрами чтения
+    """
+    encoding = 'utf-8' if path.endswith('.csv') else 'latin'
+    with Path(path).open('r', encoding=encoding, errors='replace') as f:
+        sample = f.read(sample_size)
+    lines = sample.splitlines()
+    # Последняя строка могла попасть в выборку не полностью
+    if len(sample) == sample_size and len(lines) > 1:
+        lines.pop()
+    if not path.endswith('.csv'):
+        delimiter = '\t'
+    else:
+        try:
+            delimiter = csv.Sniffer().sniff(lines[0]).delimiter
+        except (csv.Error, IndexError):
+            delimiter = ','
+    # Заголовок - первая строка, в которой есть разделитель
+    header_row = next(
+        (i for i, line in enumerate(lines) if delimiter in line),
+        0,
+    )
+    # Десятичный разделитель определяется по числам в первых строках
+    first_data_row = header_row + 1
+    values = [
+        value.strip()
+        for line in lines[first_data_row:]
+        for value in line.split(delimiter)
+    ]
+    points = sum(bool(re.fullmatch(r'-?\d+\.\d+', i)) for i in values)
+    commas = sum(bool(re.fullmatch(r'-?\d+,\d+', i)) for i in values)
+    columns = next(csv.reader(lines[header_row:], delimiter=delimiter), [])
+    return {
+        'delimiter': delimiter,
+        'decimal': '.' if delimiter == ',' or points > commas else ',',
+        'encoding': encoding,
+        'header_row': header_row,
+        'columns': columns,
+    }
+
+
+def get_parse_settings(device: Device, path: str, user_upload=False) -> dict:
+    """
+    Функция, возвращающая параметры чтения исходных файлов прибора.
+    Параметры определяются по первому файлу и сохраняются в БД,
+    файлы пользователей разбираются отдельно и не сохраняются.
+    :param device: объект записи в БД из таблицы devices
+    :param path: путь к исходному файлу
+    :param user_upload:
+    Флаг, отображающий, загружает ли пользователь свои данные
+    :return: словарь с параметрами чтения
+    """
+    if user_upload:
+        return detect_parse_settings(path)
+    settings = ParseSettings.query.filter_by(device_id=device.id).first()
+    if settings:
+        return settings.to_dict()
+    settings = ParseSettings(
+        device_id=device.id,
+        **detect_parse_settings(path),
+    )
+    db.session.add(settings)
+    db.session.commit()
+    return settings.to_dict()
+
+
+def forget_parse_settings(device: Device) -> None:
+    """
+    Функция, удаляющая сохранённые параметры чтения файлов прибора,
+    чтобы при следующем чтении они определились заново
+    :param device: объект записи в БД из таблицы devices
+    """
+    ParseSettings.query.filter_by(device_id=device.id).delete()
+    db.session.commit()
+
+
+def read_raw_file(
+    path: str,
+    settings: dict,
+    usecols: list[str],
+    dtype: dict[str, str],
+    chunk_rows: int = ingest_chunk_rows,
+) -> TextFileReader:
+    """
+    Функция, читающая исходный файл прибора частями,
+    чтобы в памяти одновременно было не больше chunk_rows строк.
+    Файл читается быстрым C парсером с известными параметрами,
+    считываются только нужные столбцы.
+    :param path: путь к исходному файлу
+    :param settings: параметры чтения файла
+    :param usecols: столбцы, которые нужно прочитать
+    :param dtype: типы столбцов
+    :param chunk_rows: число строк в одной части
+    :return: объект, по которому части файла перебираются в цикле
+    """
+    usecols = set(usecols)
+    return pd.read_csv(
+        path,
+        sep=settings['delimiter'],
+        decimal=settings['decimal'],
+        encoding=settings['encoding'],
+        header=settings['header_row'],
+        usecols=lambda x: x in usecols,
+        dtype=dtype,
+        engine='c',
+        on_bad_lines='skip',
+        chunksize=chunk_rows,
+    )
+
+
+def read_raw_file_slow(
+    path: str,
+    chunk_rows: int = ingest_chunk_rows,
+) -> TextFileReader:
+    """
+    Функция, читающая исходный файл прибора частями медленным парсером,
+    который сам определяет разделитель. Используется, если файл
+    не удалось прочитать с сохранёнными параметрами
+    :param path: путь к исходному файлу
+    :param chunk_rows: число строк в одной части
+    :return: объект, по которому части файла перебираются в цикле
+    """
     if path.endswith('.csv'):
-        df = pd.read_csv(
+        return pd.read_csv(
             path,
             sep=None,
             engine='python',
             decimal=',',
             on_bad_lines='skip',
+            chunksize=chunk_rows,
         )
-    else:
-        df = pd.read_csv(
-            path,
-            sep='\t',
-            encoding='latin',
-            decimal=',',
-            on_bad_lines='skip',
-        )
-    # Если файл пустой, то останавливаем пред обработку
-    if df.shape[0] == 0:
-        return
-    # Получение временного столбца
-    if app:
-        with app.app_context():
-            time_col = get_time_col(graph)
-    else:
-        time_col = get_time_col(graph)
-    # Получение всех столбцов прибора
-    columns = [j.name for j in graph.columns if j.use]
-    if any(
-        (i not in list(df.columns) for i in [time_col] + columns),
-    ):
-        raise ColumnsMatchError('Проблемы с совпадением столбцов')
+    return pd.read_csv(
+        path,
+        sep='\t',
+        encoding='latin',
+        decimal=',',
+        on_bad_lines='skip',
+        chunksize=chunk_rows,
+    )
+
+
+def make_ingest_spec(graph: Graph, device: Device, settings: dict) -> dict:
+    """
+    Функция, собирающая всё, что нужно для разбора исходных файлов графика,
+    в словарь из простых типов, который можно передать в другой процесс.
+    Вызывается в контексте приложения
+    :param graph: объект записи в БД из таблицы graphs
+    :param device: объект записи в БД из таблицы devices
+    :param settings: параметры чтения исходных файлов прибора
+    :return: словарь с описанием разбора
+    """
+    time_col = get_time_col(graph)
     res = [time_col]
     for i in [
         [col.name for col in g.columns if col.use == 1] for g in device.graphs
     ]:
         res += i
-    df = df[res]
-    df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
-    if not Path(f'proc_data/{device.name}').exists():
-        Path(f'proc_data/{device.name}').mkdir(parents=True)
-    # НЕ тривиально: я создаю столбец timestamp,
-    # тк дальше это основной временной столбец
-    try:
-        if time_col == 'timestamp':
-            df['timestamp'] = df['timestamp'].apply(
-                lambda x: datetime.fromtimestamp(x),
+    # Столбец, используемый несколькими графиками, сохраняется один раз
+    res = list(dict.fromkeys(res))
+    # Временной столбец разбирается позже, остальные сразу читаются числами
+    dtype = dict.fromkeys(res[1:], 'float64')
+    dtype[time_col] = 'float64' if time_col == 'timestamp' else 'str'
+    return {
+        'device_name': device.name,
+        'graph_id': graph.id,
+        'time_format': graph.time_format,
+        'time_col': time_col,
+        # Проверяются столбцы всех графиков прибора,
+        # поскольку все они сохраняются в разделы
+        'columns': res[1:],
+        'res': res,
+        'dtype': dtype,
+        'settings': settings,
+    }
+
+
+def parse_raw_chunks(
+    reader: TextFileReader,
+    spec: dict,
+) -> Iterator[pd.DataFrame]:
+    """
+    Функция, пред обрабатывающая части исходного файла: очистка строк,
+    разбор времени в столбец timestamp и разрывы на месте промежутков
+    :param reader: объект, по которому перебираются части файла
+    :param spec: описание разбора (см. make_ingest_spec)
+    :return: пред обработанные части файла
+    :raises ColumnsMatchError: в файле нет нужных столбцов
+    :raises TimeFormatError: время не удалось разобрать
+    """
+    time_col, res = spec['time_col'], spec['res']
+    # Последняя дата предыдущей части файла
+    last_time = None
+    for df in reader:
+        # Пустые части пропускаются
+        if df.shape[0] == 0:
+            continue
+        if any(
+            (i not in list(df.columns) for i in [time_col] + spec['columns']),
+        ):
+            raise ColumnsMatchError('Проблемы с совпадением столбцов')
+        df = clean_columns(df[res], time_col)
+        # НЕ тривиально: я создаю столбец timestamp,
+        # тк дальше это основной временной столбец
+        try:
+            if time_col == 'timestamp':
+                df['timestamp'] = parse_epoch(df['timestamp'])
+            else:
+                df['timestamp'] = parse_time_column(
+                    df[time_col],
+                    spec['graph_id'],
+                    spec['time_format'],
+                )
+        except (TypeError, ValueError):
+            raise TimeFormatError('Проблемы с форматом времени')
+        # Удаление пробелов, в том числе на стыке с предыдущей частью
+        chunk_last_time = df['timestamp'].max()
+        df = proc_spaces(df, 'timestamp', last_time)
+        last_time = chunk_last_time
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        yield df
+
+
+def open_raw_file(path: str, spec: dict, slow=False) -> TextFileReader:
+    """
+    Функция, открывающая исходный файл для чтения частями
+    :param path: путь к исходному файлу
+    :param spec: описание разбора (см. make_ingest_spec)
+    :param slow: читать ли медленным парсером без сохранённых параметров
+    :return: объект, по которому части файла перебираются в цикле
+    """
+    if slow:
+        return read_raw_file_slow(path)
+    return read_raw_file(path, spec['settings'], spec['res'], spec['dtype'])
+
+
+def split_by_month(df: pd.DataFrame) -> Iterator[tuple[str, pd.DataFrame]]:
+    """
+    Функция, разбивающая датафрейм на разделы-месяцы за один проход
+    :param df: датафрейм со столбцом timestamp
+    :return: пары (название раздела, данные раздела)
+    """
+    for period, df_month in df.groupby(df['timestamp'].dt.to_period('M')):
+        yield f'{period.year}_{period.month:02d}', df_month
+
+
+def estimate_rows(path: str, sample: int = 1 << 16) -> int:
+    """
+    Функция, оценивающая число строк файла по его размеру
+    и числу переводов строк в его начале
+    :param path: путь к файлу
+    :param sample: сколько байт с начала файла просматривается
+    :return: примерное число строк
+    """
+    with Path(path).open('rb') as f:
+        head = f.read(sample)
+    lines = head.count(b'\n')
+    if len(head) < sample or not lines:
+        return lines
+    return Path(path).stat().st_size * lines // len(head)
+
+
+def settings_match(path: str, settings: dict) -> bool:
+    """
+    Функция, проверяющая, что файл читается с сохранёнными параметрами:
+    разделитель, кодировка и строка заголовка определяются по его началу
+    :param path: путь к исходному файлу
+    :param settings: сохранённые параметры чтения файлов прибора
+    """
+    detected = detect_parse_settings(path)
+    return all(
+        detected[i] == settings[i]
+        for i in ('delimiter', 'encoding', 'header_row')
+    )
+
+
+def iter_raw_file(
+    path: str,
+    spec: dict,
+) -> Iterator[tuple[pd.DataFrame, bool]]:
+    """
+    Функция, перебирающая части разобранного исходного файла.
+    Если файл не подошёл под сохранённые параметры или типы столбцов,
+    он перечитывается медленным парсером с начала, поэтому часть данных
+    может прийти повторно (при записи повторы объединяются).
+    Если же нужных столбцов нет в заголовке, прочитанном с подходящими
+    параметрами, файл не перечитывается: медленный парсер их тоже не найдёт
+    :param path: путь к исходному файлу
+    :param spec: описание разбора (см. make_ingest_spec)
+    :return: пары (часть файла, прочитана ли она медленным парсером)
+    :raises ColumnsMatchError: в файле нет нужных столбцов
+    """
+    for slow in (False, True):
+        try:
+            with open_raw_file(path, spec, slow) as reader:
+                for df in parse_raw_chunks(reader, spec):
+                    yield df, slow
+            return
+
+        except ColumnsMatchError:
+            if slow or settings_match(path, spec['settings']):
+                raise
+            logger.warning(
+                '%s: файл %s прочитан медленным парсером',
+                spec['device_name'],
+                path,
             )
-        else:
-            df['timestamp'] = pd.to_datetime(
-                df[time_col],
-                format=make_format_date(graph.time_format),
+
+        except (ValueError, UnicodeDecodeError):
+            if slow:
+                raise
+            logger.warning(
+                '%s: файл %s прочитан медленным парсером',
+                spec['device_name'],
+                path,
             )
-    except (TypeError, ValueError):
+
+
+def parse_raw_file(path: str, spec: dict) -> tuple[dict, bool]:
+    """
+    Функция, полностью разбирающая один небольшой исходный файл
+    для пакетной пред обработки. Запускается в пуле процессов,
+    поэтому не обращается к БД
+    :param path: путь к исходному файлу
+    :param spec: описание разбора (см. make_ingest_spec)
+    :return: словарь {название раздела: данные раздела} и флаг того,
+    что файл пришлось читать медленным парсером
+    """
+    frames, slow = [], False
+    for df, chunk_slow in iter_raw_file(path, spec):
+        if chunk_slow and not slow:
+            # Прочитанное быстрым парсером заменяется перечитанным
+            frames, slow = [], True
+        frames.append(df)
+    if not frames:
+        return {}, slow
+    return dict(split_by_month(pd.concat(frames, ignore_index=True))), slow
+
+
+def preprocessing_one_file(
+    graph: Graph,
+    path: str,
+    user_upload=False,
+    app=None,
+) -> None:
+    """
+    Функция для пред обработки файла прибора.
+    Файл читается и раскладывается по разделам частями,
+    поэтому объём используемой памяти не зависит от размера файла.
+    :param graph: объект записи в БД из таблицы graphs
+    :param path: путь, по которому расположен исходный файл с данными.
+    :param user_upload:
+    Флаг, отображающий, загружает ли пользователь свои данные
+    :param app: Объект приложения Flask
+    """
+    if app:
+        with app.app_context():
+            device = Device.query.filter_by(id=graph.device_id).first()
+            settings = get_parse_settings(device, path, user_upload)
+            spec = make_ingest_spec(graph, device, settings)
+    else:
+        device = Device.query.filter_by(id=graph.device_id).first()
+        settings = get_parse_settings(device, path, user_upload)
+        spec = make_ingest_spec(graph, device, settings)
+    partition_columns = ['timestamp'] + spec['res'][1:]
+    any_slow = False
+    try:
+        for df, slow in iter_raw_file(path, spec):
+            any_slow = any_slow or slow
+            # Перераспределение данных по разделам-месяцам
+            # (один раздел - один месяц)
+            for partition, df_month in split_by_month(df):
+                save_month_partition(
+                    df_month,
+                    device.name,
+                    partition,
+                    partition_columns,
+                    user_upload=user_upload,
+                )
+
+    except TimeFormatError:
         if not app:
-            raise TimeFormatError('Проблемы с форматом времени')
+            raise
         return
-    time_col = 'timestamp'
-    # Удаление пробелов
-    df = proc_spaces(df, time_col)
-    df[time_col] = pd.to_datetime(df[time_col])
-    # Перераспределение данных по файлам-месяцам (один файл - один месяц)
-    for year in df[time_col].dt.year.unique():
-        for month in df[time_col].dt.month.unique():
-            df_month = df.loc[
-                (
-                    (df[time_col].dt.month == month)
-                    & (df[time_col].dt.year == year)
-                )
+
+    finally:
+        # Файл не подошёл под сохранённые параметры или типы столбцов
+        # и был перечитан медленным парсером (уже записанные части
+        # при этом просто объединились сами с собой), поэтому параметры
+        # определятся заново по следующему файлу
+        if any_slow and not user_upload:
+            if app:
+                with app.app_context():
+                    forget_parse_settings(device)
+            else:
+                forget_parse_settings(device)
+
+    update_rollups(device.name)
+    mark_device_stats(device.id, device.name, ingested=True, app=app)
+
+
+def update_device_stats(
+    device_id: int,
+    device_name: str,
+    ingested=False,
+    rendered=False,
+) -> tuple[datetime | None, datetime | None]:
+    """
+    Функция, обновляющая статистику прибора в БД.
+    Границы данных и число строк берутся из манифеста разделов,
+    поэтому сами разделы не читаются. Вызывается в контексте приложения
+    :param device_id: id прибора
+    :param device_name: название прибора
+    :param ingested: были ли только что пред обработаны данные прибора
+    :param rendered: были ли только что отрисованы графики прибора
+    :return: первая и последняя дата данных прибора
+    """
+    # Отдельная сессия: фиксация в общей сессии сбросила бы загруженные
+    # вызывающим кодом объекты графиков
+    with Session(db.engine) as session:
+        stats = (
+            session.query(DeviceStats).filter_by(device_id=device_id).first()
+        )
+        if stats is None:
+            stats = DeviceStats(device_id=device_id, rows=0)
+            session.add(stats)
+        if ingested or stats.last_timestamp is None:
+            entries = [
+                i
+                for i in get_storage().manifest(device_name).values()
+                if i['min']
             ]
-            month = '0' + str(month) if month < 10 else str(month)
-            file_path = f'proc_data/{device.name}/{year}_{month}.csv'
-            # Если файл уже существовал ранее
-            if Path(file_path).exists() or user_upload:
-                df_help = pd.read_csv(file_path)
-                df_month.loc[:, time_col] = pd.to_datetime(
-                    df_month.loc[:, time_col],
-                )
-                df_help[time_col] = pd.to_datetime(df_help[time_col])
-                # Два датафрейма объединяются
-                result = pd.merge(df_month, df_help, on=time_col, how='outer')
-                for column in df_month.columns:
-                    if column in df_help.columns and column != time_col:
-                        result[column] = result[column + '_x'].fillna(
-                            result[column + '_y'],
-                        )
-                        result.drop(
-                            columns=[column + '_x', column + '_y'],
-                            inplace=True,
-                        )
-                result.drop_duplicates()
-                df_month = result
-            if len(df_month) == 0:
-                continue
-            df_month = df_month.sort_values(by=time_col).drop_duplicates(
-                subset=[time_col],
+            stats.first_timestamp = min(
+                (datetime.fromisoformat(i['min']) for i in entries),
+                default=None,
             )
-
-            res = [time_col]
-            for i in [
-                [col.name for col in g.columns if col.use == 1]
-                for g in device.graphs
-            ]:
-                res += i
-            for column in res:
-                if column not in df_month.columns:
-                    df_month[column] = pd.NA
-            df_month = df_month[res]
-            df_month.to_csv(file_path, index=False)
+            stats.last_timestamp = max(
+                (datetime.fromisoformat(i['max']) for i in entries),
+                default=None,
+            )
+            stats.rows = sum(i['rows'] for i in entries)
+        if ingested:
+            stats.last_ingest = datetime.now()
+        if rendered:
+            stats.last_render = datetime.now()
+        first, last = stats.first_timestamp, stats.last_timestamp
+        session.commit()
+    return first, last
 
 
-def choose_range(graph: Graph, app=None) -> tuple[pd.Timestamp, pd.Timestamp]:
+def get_device_range(
+    device_id: int,
+    app=None,
+) -> tuple[pd.Timestamp | None, pd.Timestamp | None]:
     """
-    Функция для вывода границ, которые будут отображаться на графике
-    :param graph: объект записи в БД из таблицы graphs
+    Функция, возвращающая первую и последнюю дату данных прибора из БД
+    :param device_id: id прибора
     :param app: объект приложения Flask
+    :return: первая и последняя дата (None, если данных нет)
     """
-    list_files = os.listdir(f'proc_data/{graph.device.name}')
     if app:
         with app.app_context():
-            name = Device.query.filter_by(id=graph.device_id).first().name
+            return get_device_range(device_id)
+
+    stats = DeviceStats.query.filter_by(device_id=device_id).first()
+    if stats is None or stats.last_timestamp is None:
+        device = Device.query.filter_by(id=device_id).first()
+        first, last = update_device_stats(device.id, device.name)
     else:
-        name = Device.query.filter_by(id=graph.device_id).first().name
-    proc_data = f'proc_data/{name}/{max(list_files)}'
-    max_date = pd.to_datetime(
-        pd.read_csv(proc_data)['timestamp'].iloc[-1],
+        first, last = stats.first_timestamp, stats.last_timestamp
+    return (
+        pd.Timestamp(first) if first else None,
+        pd.Timestamp(last) if last else None,
     )
+
+
+def mark_device_stats(
+    device_id: int,
+    device_name: str,
+    ingested=False,
+    rendered=False,
+    app=None,
+) -> None:
+    """
+    Обёртка над update_device_stats, создающая контекст приложения
+    :param device_id: id прибора
+    :param device_name: название прибора
+    :param ingested: были ли только что пред обработаны данные прибора
+    :param rendered: были ли только что отрисованы графики прибора
+    :param app: объект приложения Flask
+    """
+    if app:
+        with app.app_context():
+            update_device_stats(device_id, device_name, ingested, rendered)
+    else:
+        update_device_stats(device_id, device_name, ingested, rendered)
+
+
+def choose_range(graph: Graph, app=None) -> tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Функция для вывода границ, которые будут отображаться на графике.
+    Последняя дата берётся из статистики прибора в БД
+    :param graph: объект записи в БД из таблицы graphs
+    :param app: объект приложения Flask
+    """
+    max_date = get_device_range(graph.device_id, app=app)[1]
+    # Как и при поиске по разделам, отсутствие данных - IndexError
+    if max_date is None:
+        raise IndexError(graph.device_id)
     min_date = max_date - timedelta(days=14)
     return min_date, max_date
 
@@ -427,55 +1249,413 @@ def make_graph(
                 else '%Y-%m-%dT%H:%M:%S'
             ),
         )
-    # Общий временной столбец
-    time_col = 'timestamp'
     # Если любая из границ не существует
     if not begin_record_date or not end_record_date:
         begin_record_date, end_record_date = choose_range(graph, app=app)
     # Задаем промежуток прорисовки согласно spec_act
-    if spec_act == 'full':
-        begin_record_date = end_record_date - timedelta(days=15)
-    if spec_act == 'recent':
-        begin_record_date = end_record_date - timedelta(days=3)
-    current_date, com_data = begin_record_date, pd.DataFrame()
-    # Считываем и объединяем файлы,
-    # которые могут содержать данные нужные для отрисовки
-    while current_date <= end_record_date + timedelta(days=100):
-        try:
-            data = pd.read_csv(
-                f'proc_data/'
-                f'{graph.device.name}/'
-                f'{current_date.strftime("%Y_%m")}.csv',
-            )
-            com_data = pd.concat([com_data, data], ignore_index=True)
-            current_date += timedelta(days=25)
+    if spec_act in render_windows:
+        begin_record_date = end_record_date - timedelta(
+            days=render_windows[spec_act],
+        )
+    com_data = load_device_data(
+        graph.device.name,
+        begin_record_date,
+        end_record_date,
+        render_level(
+            spec_act,
+            graph.device.name,
+            begin_record_date,
+            end_record_date,
+        ),
+    )
+    if spec_act == 'download':
+        return render_graph(
+            graph,
+            spec_act,
+            com_data,
+            begin_record_date,
+            end_record_date,
+            app=app,
+        )
+    render_graph(
+        graph,
+        spec_act,
+        com_data,
+        begin_record_date,
+        end_record_date,
+        app=app,
+    )
+    mark_device_stats(
+        graph.device_id,
+        graph.device.name,
+        rendered=True,
+        app=app,
+    )
+    return None
 
-        except FileNotFoundError:
-            current_date += timedelta(days=25)
 
-    com_data = com_data.drop_duplicates()
-    com_data[time_col] = pd.to_datetime(com_data[time_col])
-    m = max(com_data[time_col])
-    last_48_hours = [m - timedelta(days=2), m]
-    last_2_weeks = [m - timedelta(days=14), m]
+def make_graphs(targets: list[tuple[Graph, str]], app=None) -> None:
+    """
+    Функция для отрисовки нескольких графиков одного прибора
+    (например, полного и короткого по каждому его графику).
+    Данные прибора считываются один раз за самый длинный промежуток,
+    а каждый график отрисовывается по своему срезу этих данных
+    :param targets: пары (объект записи в БД из таблицы graphs,
+    full или recent), все графики должны относиться к одному прибору
+    :param app: объект приложения Flask
+    """
+    if not targets:
+        return
+    graph = targets[0][0]
+    end_record_date = choose_range(graph, app=app)[1]
+    # Графики, которым подходит один уровень агрегации,
+    # отрисовываются по одним и тем же считанным данным
+    groups: dict[str | None, list[tuple[Graph, str]]] = {}
+    for target in targets:
+        level = render_level(
+            target[1],
+            graph.device.name,
+            end_record_date - timedelta(days=render_windows[target[1]]),
+            end_record_date,
+        )
+        groups.setdefault(level, []).append(target)
+    for level, group in groups.items():
+        begin_record_date = end_record_date - timedelta(
+            days=max(render_windows[spec_act] for _, spec_act in group),
+        )
+        com_data = load_device_data(
+            graph.device.name,
+            begin_record_date,
+            end_record_date,
+            level,
+        )
+        for graph, spec_act in group:
+            render_graph(graph, spec_act, com_data, app=app)
+    mark_device_stats(
+        graph.device_id,
+        graph.device.name,
+        rendered=True,
+        app=app,
+    )
 
-    # Обрезаем com_data согласно временным рамкам в зависимости от spec_act
-    if spec_act == 'recent':
-        com_data = com_data.loc[
-            (last_48_hours[0] <= pd.to_datetime(com_data[time_col]))
-            & (pd.to_datetime(com_data[time_col]) <= last_48_hours[1])
-        ]
-    if spec_act == 'full':
-        com_data = com_data.loc[
-            (last_2_weeks[0] <= pd.to_datetime(com_data[time_col]))
-            & (pd.to_datetime(com_data[time_col]) <= last_2_weeks[1])
-        ]
-    com_data.set_index(time_col, inplace=True)
-    com_data = com_data.replace(
+
+def make_device_graphs(graphs: list[Graph], app=None) -> None:
+    """
+    Функция, отрисовывающая графики прибора всех видов из render_windows
+    за один вызов make_graphs
+    :param graphs: объекты записей в БД из таблицы graphs одного прибора
+    :param app: объект приложения Flask
+    """
+    make_graphs(
+        [(graph, spec_act) for graph in graphs for spec_act in render_windows],
+        app=app,
+    )
+
+
+def render_level(
+    spec_act: str,
+    device_name: str,
+    begin_record_date: pd.Timestamp,
+    end_record_date: pd.Timestamp,
+) -> str | None:
+    """
+    Функция, выбирающая уровень агрегации данных для графика.
+    Короткий график и выгрузка строятся по исходным данным,
+    как и графики приборов, данные которых не плотнее уровней
+    :param spec_act: full, recent, download - метка графика
+    :param device_name: название прибора
+    :param begin_record_date: начальная дата графика
+    :param end_record_date: конечная дата графика
+    :return: уровень агрегации или None
+    """
+    if spec_act in ('recent', 'download'):
+        return None
+    return choose_level(
+        begin_record_date,
+        end_record_date,
+        render_points,
+        sampling_step(device_name),
+    )
+
+
+def load_device_data(
+    device_name: str,
+    begin_record_date: pd.Timestamp,
+    end_record_date: pd.Timestamp,
+    level: str | None = None,
+) -> pd.DataFrame:
+    """
+    Функция, считывающая и объединяющая разделы прибора,
+    которые могут содержать данные за указанный промежуток.
+    Все столбцы, кроме временного, приводятся к числам
+    :param device_name: название прибора
+    :param begin_record_date: начальная дата промежутка
+    :param end_record_date: конечная дата промежутка
+    :param level: уровень агрегации (None - исходные данные)
+    :return: датафрейм с данными прибора
+    """
+    time_col = 'timestamp'
+    if level:
+        # Уровни, не построенные при пред обработке
+        # (например, после переноса хранилища), строятся здесь
+        update_rollups(device_name)
+        com_data = read_rollup(
+            device_name,
+            level,
+            begin_record_date,
+            end_record_date,
+        )
+    else:
+        # Считываются только разделы, пересекающиеся с промежутком,
+        # и только строки внутри него
+        com_data = get_storage().read_range(
+            device_name,
+            begin_record_date,
+            end_record_date,
+        )
+    com_data[time_col] = pd.to_datetime(com_data[time_col])
+    values = com_data.columns.drop(time_col)
+    # Десятичные запятые могут остаться только в текстовых столбцах
+    # разделов, записанных до преобразования чисел при пред обработке
+    object_cols = com_data[values].select_dtypes(include='object').columns
+    com_data[object_cols] = com_data[object_cols].replace(
         ',',
         '.',
         regex=True,
-    ).astype(float)
+    )
+    com_data[values] = com_data[values].astype(float)
+    # Повторы и порядок строк исправляются один раз для всех графиков,
+    # которые строятся по этим данным
+    return com_data.drop_duplicates(subset=[time_col]).sort_values(
+        by=time_col,
+        ignore_index=True,
+    )
+
+
+def decimate(
+    df: pd.DataFrame,
+    time_col: str,
+    columns: list[str],
+    points: int = render_points,
+) -> dict[str, pd.DataFrame]:
+    """
+    Функция, прореживающая данные для отрисовки с сохранением пиков.
+    Промежуток времени делится на points // 2 равных частей, и в каждой
+    из них остаются строки с наименьшим и наибольшим значением столбца.
+    Каждый столбец прореживается отдельно, поэтому у каждой линии
+    не больше points точек. Строки-разрывы (все значения пусты),
+    первая и последняя строки сохраняются всегда
+    :param df: отсортированный по времени датафрейм
+    :param time_col: временной столбец
+    :param columns: столбцы, которые будут отрисованы
+    :param points: наибольшее число точек одной линии
+    :return: словарь {столбец: датафрейм из временного столбца и его}
+    """
+    buckets_count = max(points // 2, 1)
+    if len(df) <= points or not columns:
+        return {i: df[[time_col, i]] for i in columns}
+    times = df[time_col].to_numpy('datetime64[ns]').astype(np.int64)
+    span = max(times[-1] - times[0], 1)
+    buckets = ((times - times[0]) / span * buckets_count).astype(np.int64)
+    buckets = np.minimum(buckets, buckets_count - 1)
+    # Строки отсортированы по времени, поэтому части идут подряд
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+    values = df[columns].to_numpy(dtype=float)
+    gaps = np.isnan(values).all(axis=1)
+    gaps[[0, -1]] = True
+    result = {}
+    for i, column in enumerate(columns):
+        keep = gaps.copy()
+        for reduce in (np.fmin, np.fmax):
+            # fmin и fmax пропускают NaN, если в части есть хоть одно значение
+            extremes = np.repeat(
+                reduce.reduceat(values[:, i], starts),
+                counts,
+            )
+            # Первое вхождение экстремума в каждой части
+            rows = np.flatnonzero(values[:, i] == extremes)
+            keep[rows[np.diff(buckets[rows], prepend=-1) != 0]] = True
+        result[column] = df.loc[keep, [time_col, column]]
+    return result
+
+
+def graph_data_path(graph_name: str, spec_act: str) -> Path:
+    """
+    Функция, возвращающая путь к данным отрисованного графика
+    :param graph_name: название графика
+    :param spec_act: full или recent
+    """
+    return Path(graphs_path) / spec_act / f'graph_{graph_name}.json'
+
+
+def typed_array(values: np.ndarray, dtype: str) -> dict:
+    """
+    Функция, кодирующая массив в двоичный массив plotly.js:
+    байты массива numpy в base64 без перевода чисел в текст
+    :param values: массив значений
+    :param dtype: тип элементов (f4 или f8)
+    :return: словарь вида {'dtype': 'f4', 'bdata': '...'}
+    """
+    data = np.ascontiguousarray(values, dtype=f'<{dtype}')
+    return {'dtype': dtype, 'bdata': base64.b64encode(data).decode()}
+
+
+def encode_typed_arrays(figure: dict) -> dict:
+    """
+    Функция, заменяющая данные линий графика двоичными массивами.
+    Время записывается как миллисекунды от начала эпохи (f8), значения -
+    как числа одинарной точности (f4). plotly.js читает такие массивы
+    без разбора текста, и файл графика получается в разы меньше
+    :param figure: график в виде словаря (fig.to_plotly_json())
+    :return: тот же словарь с закодированными x и y
+    """
+    for trace in figure['data']:
+        times = pd.to_datetime(np.asarray(trace['x']))
+        trace['x'] = typed_array(times.asi8 // 10**6, 'f8')
+        trace['y'] = typed_array(np.asarray(trace['y'], dtype=float), 'f4')
+    # Числа по оси x - даты, а не просто числа
+    figure['layout'].setdefault('xaxis', {})['type'] = 'date'
+    return figure
+
+
+def save_graph_data(figure: dict, graph_name: str, spec_act: str) -> None:
+    """
+    Функция, сохраняющая график в виде json (данные и макет) и его сжатую
+    копию, которая отдаётся браузерам без повторного сжатия.
+    Файлы подменяются целиком, чтобы не отдать их наполовину записанными.
+    Если установлен orjson, plotly сериализует график с его помощью
+    :param figure: график в виде словаря (make_figure)
+    :param graph_name: название графика
+    :param spec_act: full или recent
+    """
+    path = graph_data_path(graph_name, spec_act)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if graph_encoding == 'typed':
+        figure = encode_typed_arrays(figure)
+    content = pio.to_json(figure, validate=False).encode()
+    for target, data in (
+        (path.with_name(f'{path.name}.gz'), gzip.compress(content)),
+        (path, content),
+    ):
+        new_path = target.with_name(f'{target.name}.new')
+        new_path.write_bytes(data)
+        new_path.replace(target)
+
+
+def make_figure(
+    graph: Graph,
+    traces: dict[str, pd.DataFrame],
+    time_col: str,
+    trace_type: str,
+    days: int,
+) -> dict:
+    """
+    Функция, собирающая график в виде словаря напрямую из массивов numpy,
+    без plotly.express и проверки каждого свойства объектами plotly.
+    Линии и макет совпадают с тем, что строил px.line
+    :param graph: объект записи в БД из таблицы graphs
+    :param traces: данные линий в порядке отрисовки:
+    {столбец: датафрейм из временного столбца и этого столбца}
+    :param time_col: временной столбец
+    :param trace_type: scattergl (WebGL) или scatter (SVG)
+    :param days: сколько последних дней показывается на графике
+    :return: словарь с данными и макетом графика
+    """
+    columns = {i.name: i for i in graph.columns if i.use}
+    # По запросу работодателей мы сделали заливку для BCbb и BCff
+    fill = 'BCbb' in columns or 'BCff' in columns
+    data = []
+    for name, trace_data in traces.items():
+        column = columns[name]
+        trace = {
+            'type': trace_type,
+            'mode': 'lines',
+            'x': trace_data[time_col].to_numpy(),
+            'y': trace_data[name].to_numpy(),
+            'name': (
+                name
+                if column.coefficient == 1
+                else f'{name} * {column.coefficient}'
+            ),
+            'line': {'color': column.color},
+            'hovertemplate': (
+                f'variable={name}<br>{time_col}=%{{x}}<br>'
+                'value=%{y}<extra></extra>'
+            ),
+            'showlegend': True,
+            # Если в настройках указано, что столбца изначально не видно,
+            # то legendonly
+            'visible': True if column.default else 'legendonly',
+        }
+        if fill:
+            trace['fill'] = 'tozeroy'
+            trace['line']['width'] = 2
+        data.append(trace)
+    # Настройка осей
+    axis = {
+        'zerolinecolor': 'grey',
+        'zerolinewidth': 1,
+        'gridcolor': 'grey',
+        'showline': True,
+        'linewidth': 1,
+        'linecolor': 'black',
+        'mirror': True,
+    }
+    now = datetime.now()
+    layout = {
+        'template': pio.templates[pio.templates.default].to_plotly_json(),
+        'title': {'text': str(graph.device.full_name)},
+        'xaxis': {
+            **axis,
+            'title': {
+                'text': [i.name for i in graph.time_columns if i.use][0],
+            },
+            'range': [now - timedelta(days), now],
+            'tickformat': '%H:%M\n%d.%m.%Y',
+            'minor': {'griddash': 'dot'},
+        },
+        'yaxis': {**axis, 'title': {'text': 'value'}},
+        'legend': {'title': {'text': 'variable'}, 'tracegroupgap': 0},
+        'margin': {'t': 60},
+        'plot_bgcolor': 'white',
+        'paper_bgcolor': 'white',
+        'showlegend': True,
+    }
+    return {'data': data, 'layout': layout}
+
+
+def render_graph(
+    graph: Graph,
+    spec_act: str,
+    com_data: pd.DataFrame,
+    begin_record_date=None,
+    end_record_date=None,
+    app=None,
+) -> None | BytesIO:
+    """
+    Функция, отрисовывающая график по уже считанным данным прибора
+    :param graph: объект записи в БД из таблицы graphs
+    :param spec_act: full, recent, download - метка,
+    которая отделяет действия только для определенных типов.
+    :param com_data: данные прибора из load_device_data (не изменяются)
+    :param begin_record_date: Начальная дата выгрузки (для download)
+    :param end_record_date: Конечная дата выгрузки (для download)
+    :param app: объект приложения Flask
+    """
+    # Общий временной столбец
+    time_col = 'timestamp'
+    # Обрезаем com_data согласно временным рамкам в зависимости от spec_act.
+    # Данные отсортированы по времени, поэтому начало промежутка
+    # находится двоичным поиском
+    if spec_act in shown_days:
+        times = com_data[time_col]
+        start = times.searchsorted(
+            times.iloc[-1] - timedelta(days=shown_days[spec_act]),
+        )
+        com_data = com_data.iloc[start:]
+    # Общие данные не изменяются, дальше работа идёт с копией
+    com_data = com_data.set_index(time_col)
     # Доступные столбцы для отрисовки
     cols_to_draw = [i.name for i in graph.columns if i.use]
     # Если spec_act == 'download', то данные сохраняются в формате csv
@@ -510,18 +1690,9 @@ def make_graph(
         mask_shifted = mask.shift(-1, fill_value=False)
         com_data = com_data[~mask_shifted]
     com_data.reset_index(inplace=True)
-    com_data = com_data.drop_duplicates(subset=[time_col])
-    com_data = com_data.sort_values(by=time_col)
     # Для упрощения анализа столбцы умножаются на заранее заданные коэффициенты
-    if app:
-        with app.app_context():
-            for i in VariableColumn.query.filter_by(
-                graph_id=graph.id,
-                use=True,
-            ):
-                com_data[i.name] = com_data[i.name] * i.coefficient
-    else:
-        for i in VariableColumn.query.filter_by(graph_id=graph.id, use=True):
+    for i in graph.columns:
+        if i.use:
             com_data[i.name] = com_data[i.name] * i.coefficient
     # Сортируем столбцы таким образом, чтобы более маленькие рисовались позже
     cols_to_draw = (
@@ -530,106 +1701,22 @@ def make_graph(
         .sort_values(ascending=False)
         .index.tolist()
     )
-    index_dict = {value: index for index, value in enumerate(cols_to_draw)}
-
-    # Используем рендеринг без WebGL, если spec_act != 'recent'
-    use_webgl = not spec_act == 'recent'
-
-    fig = px.line(
-        com_data,
-        x=time_col,
-        y=cols_to_draw,
-        render_mode='webgl' if use_webgl else 'svg',
-        color_discrete_sequence=[
-            i.color
-            for i in sorted(
-                [j for j in graph.columns if j.use],
-                key=lambda x: index_dict[x.name],
-            )
-        ],  # цвета столбцов
-    )
-    # Если в настройках указано, что столбца изначально не видно, то legendonly
-    for trace in fig.data:
-        for i in graph.columns:
-            if i.name == trace['name']:
-                trace.name = (
-                    f'{i.name}'
-                    if i.coefficient == 1
-                    else f'{i.name} * {i.coefficient}'
-                )
-                trace.visible = True if i.default else 'legendonly'
-                break
-
-    if app:
-        with app.app_context():
-            full_name = (
-                Device.query.filter_by(
-                    id=graph.device_id,
-                )
-                .first()
-                .full_name
-            )
+    if spec_act == 'recent':
+        traces = {i: com_data[[time_col, i]] for i in cols_to_draw}
     else:
-        full_name = (
-            Device.query.filter_by(
-                id=graph.device_id,
-            )
-            .first()
-            .full_name
-        )
-    # Доступные столбцы для отрисовки
-    columns = [i.name for i in graph.columns if i.use]
-    # По запросу работодателей мы сделали заливку для BCbb и BCff
-    if 'BCbb' in columns or 'BCff' in columns:
-        fig.update_traces(fill='tozeroy', line={'width': 2})
-
-    # Настройка макета
-    fig.update_layout(
-        title=str(full_name),
-        xaxis={'title': [i.name for i in graph.time_columns if i.use][0]},
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        showlegend=True,
-    )
+        # Короткий график уже сглажен, а остальные прореживаются
+        # до заданного числа точек на линию
+        traces = decimate(com_data, time_col, cols_to_draw)
 
-    # Настройка осей
-    fig.update_xaxes(
-        range=[
-            datetime.now() - timedelta(2 if spec_act == 'recent' else 14),
-            datetime.now(),
-        ],
-        zerolinecolor='grey',
-        zerolinewidth=1,
-        gridcolor='grey',
-        showline=True,
-        linewidth=1,
-        linecolor='black',
-        mirror=True,
-        tickformat='%H:%M\n%d.%m.%Y',
-        minor_griddash='dot',
-    )
-    fig.update_yaxes(
-        zerolinecolor='grey',
-        zerolinewidth=1,
-        gridcolor='grey',
-        showline=True,
-        linewidth=1,
-        linecolor='black',
-        mirror=True,
+    figure = make_figure(
+        graph,
+        traces,
+        time_col,
+        # Используем рендеринг без WebGL, если spec_act == 'recent'
+        'scatter' if spec_act == 'recent' else 'scattergl',
+        shown_days[spec_act],
     )
 
     # Сохранение графика в файл
-    offline.plot(
-        fig,
-        filename=(
-            f'templates/'
-            f'includes/'
-            f'graphs/'
-            f'{spec_act}'
-            f'/graph_{graph.name}.html'
-        ),
-        auto_open=False,
-        include_plotlyjs=False,
-    )
-
+    save_graph_data(figure, graph.name, spec_act)
     return None
@@ -112,6 +112,20 @@ class Device(BaseModel):
         db.ForeignKey('complexes.id'),
         nullable=True,
     )
+    parse_settings = db.relationship(
+        'ParseSettings',
+        backref='device',
+        lazy=True,
+        uselist=False,
+        cascade='all, delete-orphan',
+    )
+    stats = db.relationship(
+        'DeviceStats',
+        backref='device',
+        lazy=True,
+        uselist=False,
+        cascade='all, delete-orphan',
+    )
 
     def __repr__(self) -> str:
         return self.name
@@ -120,6 +134,59 @@ class Device(BaseModel):
         return self.name
 
 
+class ParseSettings(db.Model):
+    """
+    Таблица параметров чтения исходных файлов приборов.
+    Параметры определяются один раз по первому файлу прибора.
+    """
+
+    __tablename__ = 'parse_settings'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(
+        db.Integer,
+        db.ForeignKey('devices.id'),
+        nullable=False,
+        unique=True,
+    )
+    delimiter = db.Column(db.String, nullable=False)
+    decimal = db.Column(db.String, nullable=False, default=',')
+    encoding = db.Column(db.String, nullable=False, default='utf-8')
+    header_row = db.Column(db.Integer, nullable=False, default=0)
+    # Заголовок файла - список названий столбцов
+    columns = db.Column(db.JSON, nullable=True)
+
+    def to_dict(self) -> dict:
+        return {
+            'delimiter': self.delimiter,
+            'decimal': self.decimal,
+            'encoding': self.encoding,
+            'header_row': self.header_row,
+            'columns': self.columns,
+        }
+
+
+class DeviceStats(db.Model):
+    """
+    Таблица статистики пред обработанных данных приборов.
+    Обновляется при пред обработке и отрисовке, чтобы границы данных
+    прибора не приходилось искать в его разделах.
+    """
+
+    __tablename__ = 'device_stats'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(
+        db.Integer,
+        db.ForeignKey('devices.id'),
+        nullable=False,
+        unique=True,
+    )
+    first_timestamp = db.Column(db.DateTime, nullable=True)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    last_ingest = db.Column(db.DateTime, nullable=True)
+    last_render = db.Column(db.DateTime, nullable=True)
+
+
 class User(BaseModel, UserMixin):
     """
     Таблица пользователей.
@@ -282,6 +349,8 @@ class DeviceView(ProtectedView):
 
     form_excluded_columns = (
         'show',
+        'parse_settings',
+        'stats',
         'columns',
         'time_format',
         'time_columns',
@@ -0,0 +1,310 @@
+import numpy as np
+import pandas as pd
+
+from msu_aerosol.storage import get_storage, PartitionStorage, time_col
+
+__all__ = []
+
+# Папка уровней внутри папки прибора в хранилище
+rollups_dir = 'rollups'
+# Уровни агрегации от более подробного к более грубому
+rollup_levels: dict[str, pd.Timedelta] = {
+    '1min': pd.Timedelta(minutes=1),
+    '10min': pd.Timedelta(minutes=10),
+    '1h': pd.Timedelta(hours=1),
+    '1d': pd.Timedelta(days=1),
+}
+rollup_stats = ('mean', 'min', 'max', 'count')
+# Столбец с числом меток разрывов (строк без значений) в промежутке
+gaps_col = 'gaps'
+# Версия формата уровней: при её изменении уровни строятся заново
+rollups_version = 2
+
+
+def level_name(device_name: str, level: str) -> str:
+    """
+    Функция, возвращающая название уровня агрегации прибора в хранилище
+    :param device_name: название прибора
+    :param level: уровень агрегации (например, 1h)
+    """
+    return f'{device_name}/{rollups_dir}/{level}'
+
+
+def rollup_columns(df: pd.DataFrame) -> list[str]:
+    """
+    Функция, возвращающая исходные столбцы агрегированного датафрейма
+    :param df: датафрейм одного из уровней агрегации
+    """
+    return [i[: -len('_count')] for i in df.columns if i.endswith('_count')]
+
+
+def add_gap_rows(df: pd.DataFrame, step: pd.Timedelta) -> pd.DataFrame:
+    """
+    Функция, добавляющая пустые промежутки на месте разрывов.
+    Метки разрывов из proc_spaces стоят через секунду после последней
+    записи и за секунду до следующей, поэтому почти всегда попадают
+    в промежуток вместе с данными. Если за промежутком с меткой
+    нет следующего, он добавляется пустым, и линия графика там разрывается
+    :param df: датафрейм уровня агрегации со столбцом gaps
+    :param step: длина промежутка
+    :return: датафрейм с пустыми промежутками, отсортированный по времени
+    """
+    times = pd.DatetimeIndex(df[time_col])
+    new_times = (times[df[gaps_col].to_numpy() > 0] + step).difference(times)
+    if new_times.empty:
+        return df
+    empty = pd.DataFrame(
+        np.nan,
+        index=range(len(new_times)),
+        columns=df.columns,
+    )
+    empty[time_col] = new_times
+    for column in [f'{i}_count' for i in rollup_columns(df)] + [gaps_col]:
+        empty[column] = 0
+    return pd.concat([df, empty], ignore_index=True).sort_values(
+        by=time_col,
+        ignore_index=True,
+    )
+
+
+def make_rollup(df: pd.DataFrame, step: pd.Timedelta) -> pd.DataFrame:
+    """
+    Функция, агрегирующая пред обработанные данные по промежуткам.
+    Для каждого столбца считаются среднее, минимум, максимум и число
+    значений, а для промежутка - число меток разрывов в нём.
+    На месте разрывов добавляются пустые промежутки (см. add_gap_rows)
+    :param df: данные раздела прибора
+    :param step: длина промежутка
+    :return: датафрейм с началом промежутка и столбцами вида BC1_mean
+    """
+    values = df.drop(columns=time_col)
+    object_cols = values.select_dtypes(include='object').columns
+    values[object_cols] = values[object_cols].replace(',', '.', regex=True)
+    values = values.apply(pd.to_numeric, errors='coerce')
+    buckets = pd.to_datetime(df[time_col]).dt.floor(step)
+    grouped = values.groupby(buckets)
+    stats = {i: grouped.agg(i) for i in rollup_stats}
+    result = pd.DataFrame({time_col: stats['count'].index})
+    for column in values.columns:
+        for stat in rollup_stats:
+            result[f'{column}_{stat}'] = stats[stat][column].to_numpy()
+    markers = values.isna().all(axis=1) & bool(len(values.columns))
+    result[gaps_col] = (
+        markers.groupby(buckets).sum().to_numpy().astype(np.int64)
+    )
+    return add_gap_rows(result, step)
+
+
+def coarsen_rollup(df: pd.DataFrame, step: pd.Timedelta) -> pd.DataFrame:
+    """
+    Функция, собирающая более грубый уровень агрегации из более
+    подробного без обращения к исходным данным
+    :param df: датафрейм более подробного уровня
+    :param step: длина промежутка нового уровня
+    :return: датафрейм нового уровня
+    """
+    times = pd.to_datetime(df[time_col]).dt.floor(step)
+    grouped = df.groupby(times)
+    result = pd.DataFrame({time_col: grouped.size().index})
+    for column in rollup_columns(df):
+        count = grouped[f'{column}_count'].sum()
+        # Среднее пересчитывается с весом по числу значений
+        total = (df[f'{column}_mean'] * df[f'{column}_count']).groupby(
+            times,
+        )
+        result[f'{column}_mean'] = (total.sum() / count).to_numpy()
+        result[f'{column}_min'] = grouped[f'{column}_min'].min().to_numpy()
+        result[f'{column}_max'] = grouped[f'{column}_max'].max().to_numpy()
+        result[f'{column}_count'] = count.to_numpy()
+    result[gaps_col] = grouped[gaps_col].sum().to_numpy()
+    return add_gap_rows(result, step)
+
+
+def is_appended(old: dict | None, new: dict) -> bool:
+    """
+    Функция, проверяющая, что раздел с тех пор только дописывался
+    :param old: запись раздела в манифесте, по которому строились уровни
+    :param new: текущая запись раздела в манифесте
+    """
+    return bool(
+        old
+        and old.get('min')
+        and old.get('write_id')
+        and old['write_id'] == new.get('write_id')
+        and new['rows'] > old['rows'],
+    )
+
+
+def append_rollups(
+    device_name: str,
+    partition: str,
+    start: int,
+    storage: PartitionStorage,
+) -> None:
+    """
+    Функция, добавляющая в уровни агрегации дописанные в раздел строки.
+    Агрегируются только новые строки, а промежутки, которые уже есть
+    на уровне (последний промежуток и пустой промежуток за ним),
+    объединяются с ними так же, как при сборке более грубого уровня
+    :param device_name: название прибора
+    :param partition: название раздела
+    :param start: номер первой дописанной строки
+    :param storage: хранилище пред обработанных данных
+    """
+    tail = storage.read_tail(device_name, partition, start)
+    for level, step in rollup_levels.items():
+        name = level_name(device_name, level)
+        new = make_rollup(tail, step)
+        old = storage.read(name, partition)
+        first = new[time_col].iloc[0]
+        merged = coarsen_rollup(
+            pd.concat([old[old[time_col] >= first], new], ignore_index=True),
+            step,
+        )
+        storage.write(
+            name,
+            partition,
+            pd.concat([old[old[time_col] < first], merged], ignore_index=True),
+        )
+
+
+def update_rollups(
+    device_name: str,
+    storage: PartitionStorage | None = None,
+) -> None:
+    """
+    Функция, обновляющая уровни агрегации прибора.
+    Манифест разделов, по которому были построены уровни, сохраняется,
+    поэтому пересчитываются только изменившиеся с тех пор разделы.
+    В дописанный раздел агрегируются только новые строки (см. append_rollups),
+    перезаписанный раздел агрегируется заново целиком
+    :param device_name: название прибора
+    :param storage: хранилище пред обработанных данных
+    """
+    storage = storage or get_storage()
+    manifest = storage.manifest(device_name)
+    source_name = f'{device_name}/{rollups_dir}'
+    source = storage.load_manifest(source_name)
+    # Уровни старого формата строятся заново
+    if source.pop('version', None) != rollups_version:
+        source = {}
+    elif source == manifest:
+        return
+    for level in rollup_levels:
+        name = level_name(device_name, level)
+        for partition in set(storage.partitions(name)) - set(manifest):
+            storage.remove(name, partition)
+    for partition, entry in sorted(manifest.items()):
+        if source.get(partition) == entry:
+            continue
+        if is_appended(source.get(partition), entry) and all(
+            storage.exists(level_name(device_name, i), partition)
+            for i in rollup_levels
+        ):
+            append_rollups(
+                device_name,
+                partition,
+                source[partition]['rows'],
+                storage,
+            )
+            continue
+        rollup = None
+        for level, step in rollup_levels.items():
+            rollup = (
+                make_rollup(storage.read(device_name, partition), step)
+                if rollup is None
+                else coarsen_rollup(rollup, step)
+            )
+            storage.write(level_name(device_name, level), partition, rollup)
+    storage.device_path(source_name).mkdir(parents=True, exist_ok=True)
+    storage.save_manifest(
+        source_name,
+        {'version': rollups_version, **manifest},
+    )
+
+
+def sampling_step(
+    device_name: str,
+    storage: PartitionStorage | None = None,
+) -> pd.Timedelta | None:
+    """
+    Функция, оценивающая по манифесту разделов, как часто прибор
+    записывает данные (средний промежуток между строками)
+    :param device_name: название прибора
+    :param storage: хранилище пред обработанных данных
+    :return: промежуток или None, если строк для оценки мало
+    """
+    storage = storage or get_storage()
+    span, rows = pd.Timedelta(0), 0
+    for entry in storage.manifest(device_name).values():
+        if entry['min'] and entry['rows'] > 1:
+            span += pd.Timestamp(entry['max']) - pd.Timestamp(entry['min'])
+            rows += entry['rows'] - 1
+    if not rows:
+        return None
+    return span / rows
+
+
+def choose_level(
+    begin: pd.Timestamp,
+    end: pd.Timestamp,
+    points: int,
+    sample_step: pd.Timedelta | None = None,
+) -> str | None:
+    """
+    Функция, выбирающая самый грубый уровень агрегации,
+    на котором за промежуток ещё набирается нужное число точек.
+    Огибающая уровня даёт две точки на промежуток, поэтому уровни,
+    в промежуток которых попадает не больше двух исходных строк,
+    пропускаются: они не меньше исходных данных
+    :param begin: начальная дата промежутка
+    :param end: конечная дата промежутка
+    :param points: нужное число точек
+    :param sample_step: промежуток между строками прибора (см. sampling_step)
+    :return: уровень агрегации или None, если нужны исходные данные
+    """
+    span = pd.Timestamp(end) - pd.Timestamp(begin)
+    chosen = None
+    for level, step in rollup_levels.items():
+        if sample_step is not None and step <= 2 * sample_step:
+            continue
+        if span / step >= points:
+            chosen = level
+    return chosen
+
+
+def read_rollup(
+    device_name: str,
+    level: str,
+    begin: pd.Timestamp,
+    end: pd.Timestamp,
+    storage: PartitionStorage | None = None,
+) -> pd.DataFrame:
+    """
+    Функция, считывающая данные прибора за промежуток с уровня агрегации
+    в виде огибающей: минимум каждого промежутка в его начале и максимум
+    в его середине. Так на графике остаются все выбросы
+    :param device_name: название прибора
+    :param level: уровень агрегации
+    :param begin: начальная дата промежутка
+    :param end: конечная дата промежутка
+    :param storage: хранилище пред обработанных данных
+    :return: датафрейм с временным столбцом и исходными столбцами
+    """
+    storage = storage or get_storage()
+    step = rollup_levels[level]
+    df = storage.read_range(
+        level_name(device_name, level),
+        pd.Timestamp(begin).floor(step),
+        end,
+    )
+    if df.empty:
+        return df
+    times = pd.to_datetime(df[time_col]).to_numpy()
+    # Минимум и максимум каждого промежутка идут друг за другом
+    data = {time_col: np.column_stack([times, times + step / 2]).ravel()}
+    for column in rollup_columns(df):
+        data[column] = np.column_stack(
+            [df[f'{column}_min'], df[f'{column}_max']],
+        ).ravel()
+    return pd.DataFrame(data)
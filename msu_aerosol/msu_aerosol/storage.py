@@ -0,0 +1,654 @@
+from abc import ABC, abstractmethod
+import csv
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from msu_aerosol.config import storage_backend
+
+__all__ = []
+
+proc_data_path = 'proc_data'
+time_col = 'timestamp'
+
+
+class PartitionStorage(ABC):
+    """
+    Базовый класс хранилища пред обработанных данных.
+    Данные прибора хранятся по месяцам: один раздел - один месяц,
+    раздел называется по году и месяцу (например, 2024_05).
+    Для каждого прибора ведётся манифест разделов: первая и последняя
+    дата и число строк каждого раздела. Он обновляется при записи
+    и позволяет читать только разделы, пересекающиеся с промежутком.
+    Метка write_id меняется при каждой перезаписи раздела и сохраняется
+    при дописывании, поэтому по манифесту видно, что раздел только рос.
+    """
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self, root: str = proc_data_path) -> None:
+        self.root = root
+
+    def device_path(self, device_name: str) -> Path:
+        return Path(self.root) / device_name
+
+    @abstractmethod
+    def partition_path(self, device_name: str, partition: str) -> Path:
+        """
+        Путь к файлу или папке раздела.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        """
+
+    @abstractmethod
+    def partitions(self, device_name: str) -> list[str]:
+        """
+        Список разделов прибора в порядке возрастания дат.
+
+        :param device_name: Название прибора
+        :return: Список названий разделов
+        """
+
+    def exists(self, device_name: str, partition: str) -> bool:
+        return self.partition_path(device_name, partition).exists()
+
+    @abstractmethod
+    def read(
+        self,
+        device_name: str,
+        partition: str,
+        begin: pd.Timestamp | None = None,
+        end: pd.Timestamp | None = None,
+    ) -> pd.DataFrame:
+        """
+        Чтение раздела. Временной столбец возвращается в виде дат.
+        Если заданы границы, возвращаются только строки между ними.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param begin: Начальная дата (включительно)
+        :param end: Конечная дата (включительно)
+        :return: Данные раздела
+        :raises FileNotFoundError: раздела не существует
+        """
+
+    def read_tail(
+        self,
+        device_name: str,
+        partition: str,
+        start: int,
+    ) -> pd.DataFrame:
+        """
+        Чтение строк раздела, начиная с заданной.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param start: Номер первой строки
+        :return: Строки раздела с номерами от start
+        """
+
+        return self.read(device_name, partition).iloc[start:]
+
+    def read_times(self, device_name: str, partition: str) -> pd.Series:
+        """
+        Чтение только временного столбца раздела.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :return: Даты раздела
+        """
+
+        return self.read(device_name, partition)[time_col]
+
+    @abstractmethod
+    def write(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        """
+        Запись раздела целиком (существующий раздел заменяется).
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param df: Данные раздела
+        """
+
+    def append(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        """
+        Дописывание строк в конец раздела.
+        Строки должны быть позже последней записи раздела,
+        а столбцы - совпадать со столбцами раздела.
+        По умолчанию раздел считывается и перезаписывается целиком.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param df: Новые строки
+        """
+
+        self.write(
+            device_name,
+            partition,
+            pd.concat(
+                [self.read(device_name, partition), df],
+                ignore_index=True,
+            ),
+        )
+
+    def manifest_path(self, device_name: str) -> Path:
+        return self.device_path(device_name) / self.manifest_name
+
+    def save_manifest(self, device_name: str, manifest: dict) -> None:
+        path = self.manifest_path(device_name)
+        new_path = path.with_name(f'{path.name}.new')
+        with new_path.open('w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        new_path.replace(path)
+
+    def load_manifest(self, device_name: str) -> dict[str, dict]:
+        try:
+            with self.manifest_path(device_name).open(
+                'r',
+                encoding='utf-8',
+            ) as f:
+                return json.load(f)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @classmethod
+    def make_manifest_entry(cls, times: pd.Series, rows: int) -> dict:
+        times = pd.to_datetime(times).dropna()
+        write_id = uuid.uuid4().hex
+        if not len(times):
+            return {
+                'min': None,
+                'max': None,
+                'rows': rows,
+                'write_id': write_id,
+            }
+        return {
+            'min': times.min().isoformat(),
+            'max': times.max().isoformat(),
+            'rows': rows,
+            'write_id': write_id,
+        }
+
+    def update_manifest(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame | None,
+        append: bool = False,
+    ) -> None:
+        """
+        Обновление записи раздела в манифесте после его изменения.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param df: Записанные строки (None, если раздел удалён)
+        :param append: Были ли строки дописаны в конец раздела
+        """
+
+        if not self.device_path(device_name).exists():
+            return
+        manifest = self.load_manifest(device_name)
+        if df is None:
+            manifest.pop(partition, None)
+        elif append and manifest.get(partition, {}).get('min'):
+            entry = self.make_manifest_entry(df[time_col], len(df))
+            if entry['max']:
+                manifest[partition]['max'] = entry['max']
+            manifest[partition]['rows'] += len(df)
+            # Записи старого формата получают метку при первом дописывании
+            manifest[partition].setdefault('write_id', uuid.uuid4().hex)
+        elif append:
+            # Записи о разделе нет - она составляется по всему разделу
+            times = self.read_times(device_name, partition)
+            manifest[partition] = self.make_manifest_entry(times, len(times))
+        else:
+            manifest[partition] = self.make_manifest_entry(
+                df[time_col],
+                len(df),
+            )
+        self.save_manifest(device_name, manifest)
+
+    def manifest(self, device_name: str) -> dict[str, dict]:
+        """
+        Манифест разделов прибора. Разделы, записанные до появления
+        манифеста, один раз просматриваются и добавляются в него.
+
+        :param device_name: Название прибора
+        :return: Словарь вида
+        {раздел: {'min': ..., 'max': ..., 'rows': ..., 'write_id': ...}}
+        """
+
+        manifest = self.load_manifest(device_name)
+        partitions = self.partitions(device_name)
+        actual = {i: manifest[i] for i in partitions if i in manifest}
+        for partition in partitions:
+            if partition not in actual:
+                times = self.read_times(device_name, partition)
+                actual[partition] = self.make_manifest_entry(
+                    times,
+                    len(times),
+                )
+        if actual != manifest:
+            self.save_manifest(device_name, actual)
+        return actual
+
+    def read_range(
+        self,
+        device_name: str,
+        begin: pd.Timestamp,
+        end: pd.Timestamp,
+    ) -> pd.DataFrame:
+        """
+        Чтение данных прибора за промежуток. Открываются только разделы,
+        которые по манифесту пересекаются с промежутком,
+        и из каждого берутся только строки внутри него.
+
+        :param device_name: Название прибора
+        :param begin: Начальная дата (включительно)
+        :param end: Конечная дата (включительно)
+        :return: Данные за промежуток (пустой датафрейм, если их нет)
+        """
+
+        frames = [
+            self.read(device_name, partition, begin, end)
+            for partition, entry in sorted(self.manifest(device_name).items())
+            if entry['min']
+            and pd.Timestamp(entry['min']) <= end
+            and pd.Timestamp(entry['max']) >= begin
+        ]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    @abstractmethod
+    def bounds(
+        self,
+        device_name: str,
+        partition: str,
+    ) -> tuple[list[str], pd.Timestamp | None]:
+        """
+        Столбцы раздела и дата его последней записи
+        без чтения всего раздела.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :return: Список столбцов и последняя дата (None, если раздел пустой)
+        """
+
+    @abstractmethod
+    def remove(self, device_name: str, partition: str) -> None:
+        """
+        Удаление раздела.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        """
+
+
+class CsvStorage(PartitionStorage):
+    """
+    Хранилище в виде csv файлов: proc_data/<прибор>/<раздел>.csv
+    """
+
+    manifest_name = 'manifest_csv.json'
+
+    def partition_path(self, device_name: str, partition: str) -> Path:
+        return self.device_path(device_name) / f'{partition}.csv'
+
+    def partitions(self, device_name: str) -> list[str]:
+        if not self.device_path(device_name).exists():
+            return []
+        return sorted(
+            i.stem
+            for i in self.device_path(device_name).iterdir()
+            if i.suffix == '.csv'
+        )
+
+    def read(
+        self,
+        device_name: str,
+        partition: str,
+        begin: pd.Timestamp | None = None,
+        end: pd.Timestamp | None = None,
+    ) -> pd.DataFrame:
+        df = pd.read_csv(self.partition_path(device_name, partition))
+        df[time_col] = pd.to_datetime(df[time_col])
+        if begin is None and end is None:
+            return df
+        times = df[time_col]
+        mask = pd.Series(True, index=df.index)
+        if begin is not None:
+            mask &= times >= begin
+        if end is not None:
+            mask &= times <= end
+        return df.loc[mask]
+
+    def read_tail(
+        self,
+        device_name: str,
+        partition: str,
+        start: int,
+    ) -> pd.DataFrame:
+        with self.partition_path(device_name, partition).open('rb') as f:
+            header = next(
+                csv.reader([f.readline().decode(errors='replace')]),
+                [],
+            )
+            # Пропущенные строки не разбираются, а только считаются
+            # по переводам строк блоками
+            skipped = 0
+            while skipped < start:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                lines = block.count(b'\n')
+                if skipped + lines >= start:
+                    offset = -1
+                    for _ in range(start - skipped):
+                        offset = block.index(b'\n', offset + 1)
+                    f.seek(offset + 1 - len(block), os.SEEK_CUR)
+                skipped += lines
+            df = pd.read_csv(f, header=None, names=header)
+        df[time_col] = pd.to_datetime(df[time_col])
+        df.index += start
+        return df
+
+    def read_times(self, device_name: str, partition: str) -> pd.Series:
+        return pd.to_datetime(
+            pd.read_csv(
+                self.partition_path(device_name, partition),
+                usecols=[time_col],
+            )[time_col],
+        )
+
+    def write(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        self.device_path(device_name).mkdir(parents=True, exist_ok=True)
+        df.to_csv(self.partition_path(device_name, partition), index=False)
+        self.update_manifest(device_name, partition, df)
+
+    def append(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        df.to_csv(
+            self.partition_path(device_name, partition),
+            mode='a',
+            header=False,
+            index=False,
+        )
+        self.update_manifest(device_name, partition, df, append=True)
+
+    def bounds(
+        self,
+        device_name: str,
+        partition: str,
+    ) -> tuple[list[str], pd.Timestamp | None]:
+        with self.partition_path(device_name, partition).open('rb') as f:
+            header = next(
+                csv.reader([f.readline().decode(errors='replace')]),
+                [],
+            )
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position, tail = end, b''
+            # Последняя строка читается с конца файла блоками
+            while position > 0 and tail.count(b'\n') < 2:
+                position = max(position - 4096, 0)
+                f.seek(position)
+                tail = f.read(end - position)
+
+        lines = tail.decode(errors='replace').strip().splitlines()
+        if not lines or position == 0 and len(lines) < 2:
+            return header, None
+        return header, pd.to_datetime(next(csv.reader([lines[-1]]))[0])
+
+    def remove(self, device_name: str, partition: str) -> None:
+        self.partition_path(device_name, partition).unlink(missing_ok=True)
+        self.update_manifest(device_name, partition, None)
+
+
+class NpyStorage(PartitionStorage):
+    """
+    Бинарное колоночное хранилище: каждый раздел - папка
+    proc_data/<прибор>/<раздел>/ с файлом columns.json (порядок столбцов)
+    и отдельным .npy файлом на каждый столбец.
+    Числовые столбцы хранятся как числа, временной - как datetime64,
+    поэтому при чтении ничего не разбирается, а файлы отображаются
+    в память без копирования. При чтении промежутка нужные строки
+    находятся двоичным поиском по отсортированному временному столбцу.
+    """
+
+    manifest_name = 'manifest_npy.json'
+
+    def partition_path(self, device_name: str, partition: str) -> Path:
+        return self.device_path(device_name) / partition
+
+    def exists(self, device_name: str, partition: str) -> bool:
+        return (
+            self.partition_path(device_name, partition) / 'columns.json'
+        ).exists()
+
+    def partitions(self, device_name: str) -> list[str]:
+        if not self.device_path(device_name).exists():
+            return []
+        return sorted(
+            i.name
+            for i in self.device_path(device_name).iterdir()
+            if '.' not in i.name and (i / 'columns.json').exists()
+        )
+
+    @classmethod
+    def to_array(cls, column: pd.Series) -> np.ndarray:
+        """
+        Преобразование столбца в массив numpy с типом,
+        пригодным для отображения в память.
+
+        :param column: Столбец датафрейма
+        :return: Массив значений столбца
+        """
+
+        if column.dtype.kind in 'biufM':
+            return column.to_numpy()
+        numeric = pd.to_numeric(column, errors='coerce')
+        if numeric.notna().sum() == column.notna().sum():
+            return numeric.to_numpy(dtype='float64')
+        return column.fillna('').astype(str).to_numpy(dtype=str)
+
+    def read(
+        self,
+        device_name: str,
+        partition: str,
+        begin: pd.Timestamp | None = None,
+        end: pd.Timestamp | None = None,
+    ) -> pd.DataFrame:
+        path = self.partition_path(device_name, partition)
+        with (path / 'columns.json').open('r', encoding='utf-8') as f:
+            columns = json.load(f)
+        arrays = [
+            np.load(path / f'{i}.npy', mmap_mode='r')
+            for i in range(len(columns))
+        ]
+        if begin is not None or end is not None:
+            # Строки раздела отсортированы по времени
+            times = arrays[columns.index(time_col)]
+            start = (
+                0
+                if begin is None
+                else times.searchsorted(pd.Timestamp(begin).asm8)
+            )
+            stop = (
+                len(times)
+                if end is None
+                else times.searchsorted(pd.Timestamp(end).asm8, side='right')
+            )
+            arrays = [i[start:stop] for i in arrays]
+        # Если дописывание раздела прервалось, часть столбцов
+        # может оказаться длиннее временного
+        rows = min((len(i) for i in arrays), default=0)
+        arrays = [i[:rows] for i in arrays]
+        df = pd.DataFrame(dict(enumerate(arrays)), copy=False)
+        df.columns = columns
+        return df
+
+    def read_times(self, device_name: str, partition: str) -> pd.Series:
+        path = self.partition_path(device_name, partition)
+        with (path / 'columns.json').open('r', encoding='utf-8') as f:
+            columns = json.load(f)
+        return pd.Series(
+            np.load(path / f'{columns.index(time_col)}.npy', mmap_mode='r'),
+        )
+
+    def write(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        path = self.partition_path(device_name, partition)
+        new_path = path.with_name(f'{partition}.new')
+        old_path = path.with_name(f'{partition}.old')
+        shutil.rmtree(new_path, ignore_errors=True)
+        new_path.mkdir(parents=True)
+        for i in range(df.shape[1]):
+            np.save(new_path / f'{i}.npy', self.to_array(df.iloc[:, i]))
+        with (new_path / 'columns.json').open('w', encoding='utf-8') as f:
+            json.dump(list(df.columns), f, ensure_ascii=False)
+        # Раздел подменяется целиком, чтобы не читать его наполовину записанным
+        if path.exists():
+            path.rename(old_path)
+        new_path.rename(path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.update_manifest(device_name, partition, df)
+
+    @classmethod
+    def array_header(cls, dtype: np.dtype, rows: int) -> bytes:
+        """
+        Заголовок .npy файла одномерного массива.
+
+        :param dtype: Тип элементов
+        :param rows: Длина массива
+        :return: Байты заголовка вместе с сигнатурой формата
+        """
+
+        buffer = BytesIO()
+        np.lib.format.write_array_header_1_0(
+            buffer,
+            {
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': False,
+                'shape': (rows,),
+            },
+        )
+        return buffer.getvalue()
+
+    def append(
+        self,
+        device_name: str,
+        partition: str,
+        df: pd.DataFrame,
+    ) -> None:
+        """
+        Дописывание строк без перезаписи раздела: значения каждого столбца
+        дописываются в конец его .npy файла, а в заголовке файла меняется
+        только длина массива. Временной столбец дописывается последним,
+        поэтому раздел не читается с датами, для которых ещё нет значений.
+        Если новые значения нельзя без потерь привести к типу столбца
+        или новый заголовок не помещается на место старого,
+        раздел перезаписывается целиком.
+
+        :param device_name: Название прибора
+        :param partition: Название раздела
+        :param df: Новые строки
+        """
+
+        path = self.partition_path(device_name, partition)
+        with (path / 'columns.json').open('r', encoding='utf-8') as f:
+            columns = json.load(f)
+        arrays = [
+            np.load(path / f'{i}.npy', mmap_mode='r')
+            for i in range(len(columns))
+        ]
+        rows = len(arrays[columns.index(time_col)])
+        changes = []
+        for i, column in enumerate(columns):
+            new = self.to_array(df[column])
+            header = self.array_header(arrays[i].dtype, rows + len(new))
+            if (
+                len(arrays[i]) != rows
+                or not np.can_cast(new.dtype, arrays[i].dtype, 'safe')
+                or len(header) != arrays[i].offset
+            ):
+                super().append(device_name, partition, df)
+                return
+            changes.append((i, header, new.astype(arrays[i].dtype)))
+        del arrays
+        changes.sort(key=lambda x: columns[x[0]] == time_col)
+        for i, header, values in changes:
+            with (path / f'{i}.npy').open('r+b') as f:
+                f.seek(0, os.SEEK_END)
+                f.write(values.tobytes())
+                f.seek(0)
+                f.write(header)
+        self.update_manifest(device_name, partition, df, append=True)
+
+    def bounds(
+        self,
+        device_name: str,
+        partition: str,
+    ) -> tuple[list[str], pd.Timestamp | None]:
+        path = self.partition_path(device_name, partition)
+        with (path / 'columns.json').open('r', encoding='utf-8') as f:
+            columns = json.load(f)
+        timestamps = np.load(
+            path / f'{columns.index(time_col)}.npy',
+            mmap_mode='r',
+        )
+        if not len(timestamps):
+            return columns, None
+        return columns, pd.Timestamp(timestamps[-1])
+
+    def remove(self, device_name: str, partition: str) -> None:
+        shutil.rmtree(
+            self.partition_path(device_name, partition),
+            ignore_errors=True,
+        )
+        self.update_manifest(device_name, partition, None)
+
+
+storages: dict[str, type[PartitionStorage]] = {
+    'csv': CsvStorage,
+    'npy': NpyStorage,
+}
+
+
+def get_storage(name: str = storage_backend) -> PartitionStorage:
+    """
+    Функция, возвращающая хранилище пред обработанных данных по названию
+    :param name: название хранилища (csv или npy)
+    """
+    return storages[name]()
@@ -0,0 +1,341 @@
+import asyncio
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import statistics
+import time
+
+from yadisk import AsyncYaDisk, YaDisk
+from yadisk.exceptions import (
+    InternalServerError,
+    YaDiskConnectionError,
+    YaDiskError,
+)
+
+from msu_aerosol.config import download_concurrency, yadisk_token
+
+__all__ = []
+
+logger = logging.getLogger(__name__)
+main_path = 'data'
+manifests_path = 'sync_manifests'
+disk_sync = YaDisk(token=yadisk_token)
+
+
+def get_remote_items(link: str) -> list | None:
+    """
+    Функция, получающая список файлов прибора в Я.Диске за один запрос
+    :param link: ссылка, на данные прибора в Я.Диске
+    :return: список объектов файлов или None, если Я.Диск недоступен
+    """
+
+    try:
+        return list(
+            disk_sync.get_public_meta(link, limit=1000)['embedded']['items'],
+        )
+
+    except (InternalServerError, YaDiskConnectionError):
+        return None
+
+
+def select_data_items(items: list) -> list:
+    """
+    Функция, оставляющая только файлы с данными прибора.
+    Если среди файлов есть csv, то берутся только они, иначе - txt.
+    :param items: список объектов файлов из Я.Диска
+    :return: отфильтрованный список объектов файлов
+    """
+
+    csv_not_exists = all(not i['name'].endswith('.csv') for i in items)
+    extension = '.txt' if csv_not_exists else '.csv'
+    return [i for i in items if i['name'].endswith(extension)]
+
+
+def make_manifest_entry(item) -> dict:
+    """
+    Функция, формирующая запись манифеста по объекту файла из Я.Диска
+    :param item: объект файла из Я.Диска
+    :return: словарь с именем, размером, хешами и датой изменения файла
+    """
+
+    modified = item['modified']
+    return {
+        'name': item['name'],
+        'size': item['size'],
+        'md5': item['md5'],
+        'sha256': item['sha256'],
+        'modified': modified.isoformat() if modified else None,
+    }
+
+
+class SyncManifest:
+    """
+    Манифест синхронизации прибора.
+    Хранит сведения о каждом уже скачанном файле прибора,
+    чтобы при следующей синхронизации скачивать только новые
+    и изменившиеся файлы.
+    """
+
+    def __init__(self, full_name: str) -> None:
+        self.full_name = full_name
+        self.filename = f'{manifests_path}/{full_name}.json'
+        self.entries = self.load()
+
+    def load(self) -> dict[str, dict]:
+        """
+        Загрузка манифеста из файла.
+
+        :return: Словарь вида {имя файла: запись манифеста}
+        """
+
+        try:
+            with Path(self.filename).open('r', encoding='utf-8') as f:
+                return json.load(f)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self) -> None:
+        Path(manifests_path).mkdir(parents=True, exist_ok=True)
+        with Path(self.filename).open('w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+
+    def remove(self) -> None:
+        Path(self.filename).unlink(missing_ok=True)
+        self.entries = {}
+
+    def upload_interval(self, last: int = 10) -> float | None:
+        """
+        Оценка того, как часто прибор выгружает файлы в Я.Диск:
+        медиана промежутков между датами изменения последних файлов.
+
+        :param last: Сколько последних файлов учитывать
+        :return: Промежуток в секундах или None, если файлов меньше двух
+        """
+
+        modified = sorted(
+            datetime.fromisoformat(i['modified'])
+            for i in self.entries.values()
+            if i['modified']
+        )[-last:]
+        if len(modified) < 2:
+            return None
+        return statistics.median(
+            (j - i).total_seconds() for i, j in zip(modified, modified[1:])
+        )
+
+    def idle_time(self) -> float | None:
+        """
+        Сколько прошло с последней выгрузки прибора в Я.Диск.
+
+        :return: Время в секундах или None, если дат изменения нет
+        """
+
+        modified = [
+            datetime.fromisoformat(i['modified'])
+            for i in self.entries.values()
+            if i['modified']
+        ]
+        if not modified:
+            return None
+        last = max(modified)
+        return (datetime.now(last.tzinfo) - last).total_seconds()
+
+    def is_synced(self, entry: dict) -> bool:
+        """
+        Проверка, совпадает ли файл в Я.Диске с уже скачанным.
+        Если записи в манифесте нет, но файл того же размера уже лежит
+        на сервере (например, скачан до появления манифеста),
+        он тоже считается синхронизированным.
+
+        :param entry: Запись манифеста для файла из Я.Диска
+        :return: True, если файл скачивать не нужно
+        """
+
+        if entry['name'] in self.entries:
+            return self.entries[entry['name']] == entry
+        local_file = Path(f'{main_path}/{self.full_name}/{entry["name"]}')
+        if not local_file.exists():
+            return False
+        return local_file.stat().st_size == entry['size']
+
+
+class DownloadProgress:
+    """
+    Счётчик прогресса загрузки файлов прибора.
+    Пишет в лог число скачанных файлов, их объём и скорость загрузки.
+    """
+
+    def __init__(self, full_name: str, items: list) -> None:
+        self.full_name = full_name
+        self.total_files = len(items)
+        self.total_bytes = sum(i['size'] or 0 for i in items)
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, size: int) -> None:
+        self.files += 1
+        self.bytes += size or 0
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        logger.info(
+            '%s: %d/%d файлов, %.1f/%.1f МБ, %.2f МБ/с',
+            self.full_name,
+            self.files,
+            self.total_files,
+            self.bytes / 2**20,
+            self.total_bytes / 2**20,
+            self.bytes / 2**20 / elapsed,
+        )
+
+
+async def download_file(
+    disk: AsyncYaDisk,
+    full_name: str,
+    element,
+    semaphore: asyncio.Semaphore,
+    progress: DownloadProgress,
+) -> str | None:
+    """
+    Функция для скачивания файла из Я.Диска.
+    Файл потоково пишется во временный .part файл,
+    который после успешной загрузки переименовывается.
+    :param disk: асинхронный клиент Я.Диска
+    :param full_name: имя прибора
+    :param element: Объект файла, который необходимо скачать
+    :param semaphore: семафор, ограничивающий число одновременных загрузок
+    :param progress: счётчик прогресса загрузки
+    :return: путь к скачанному файлу или None, если скачать не удалось
+    """
+
+    file_path = Path(f'{main_path}/{full_name}/{element["name"]}')
+    part_path = file_path.with_name(f'{file_path.name}.part')
+    async with semaphore:
+        try:
+            await disk.download_by_link(element['file'], str(part_path))
+        except YaDiskError as e:
+            part_path.unlink(missing_ok=True)
+            logger.warning(
+                '%s: не удалось скачать %s (%s)',
+                full_name,
+                element['name'],
+                e.__class__.__name__,
+            )
+            return None
+
+    part_path.replace(file_path)
+    progress.add(element['size'])
+    return str(file_path)
+
+
+async def download_items(
+    full_name: str,
+    items: list,
+    concurrency: int = download_concurrency,
+) -> list[str]:
+    """
+    Функция для одновременной загрузки нескольких файлов прибора
+    :param full_name: имя прибора
+    :param items: объекты файлов из Я.Диска
+    :param concurrency: максимальное число одновременных загрузок
+    :return: пути к успешно скачанным файлам в порядке items
+    """
+
+    Path(f'{main_path}/{full_name}').mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = DownloadProgress(full_name, items)
+    async with AsyncYaDisk(token=yadisk_token) as disk:
+        # Ошибка одного файла не отменяет загрузку остальных
+        results = await asyncio.gather(
+            *(
+                download_file(disk, full_name, i, semaphore, progress)
+                for i in items
+            ),
+            return_exceptions=True,
+        )
+
+    paths = []
+    for item, result in zip(items, results):
+        if isinstance(result, BaseException):
+            Path(f'{main_path}/{full_name}/{item["name"]}.part').unlink(
+                missing_ok=True,
+            )
+            logger.error(
+                '%s: не удалось скачать %s',
+                full_name,
+                item['name'],
+                exc_info=result,
+            )
+        elif result:
+            paths.append(result)
+    return paths
+
+
+def sync_device(full_name: str, link: str) -> list[str] | None:
+    """
+    Функция, скачивающая только новые и изменившиеся файлы прибора
+    :param full_name: имя прибора
+    :param link: ссылка на его данные в Я.Диске
+    :return: список путей к скачанным файлам (в порядке их изменения)
+    или None, если Я.Диск недоступен
+    """
+
+    items = get_remote_items(link)
+    if items is None:
+        return None
+    items = sorted(select_data_items(items), key=lambda x: x['modified'])
+    manifest = SyncManifest(full_name)
+    remote = {i['name']: make_manifest_entry(i) for i in items}
+    # Листинг не изменился - прибор пропускается целиком
+    if remote == manifest.entries:
+        return []
+    to_download = [
+        i for i in items if not manifest.is_synced(remote[i['name']])
+    ]
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    downloaded = asyncio.run(download_items(full_name, to_download))
+    downloaded_names = {Path(i).name for i in downloaded}
+    entries = {}
+    for name, entry in remote.items():
+        if name in downloaded_names or manifest.is_synced(entry):
+            entries[name] = entry
+        # Файл, который не удалось скачать, будет скачан в следующий раз
+        elif name in manifest.entries:
+            entries[name] = manifest.entries[name]
+
+    manifest.entries = entries
+    manifest.save()
+    return downloaded
+
+
+async def download_device_data(
+    full_name: str,
+    link: str,
+    concurrency: int = download_concurrency,
+) -> list[str]:
+    """
+    Функция для загрузки всех данных прибора на сервер с Я.Диска.
+    Папка прибора запрашивается один раз, файлы скачиваются одновременно,
+    скачанные файлы записываются в манифест синхронизации.
+    :param full_name: имя прибора
+    :param link: ссылка на его Я.Диск
+    :param concurrency: максимальное число одновременных загрузок
+    :return: пути к скачанным файлам
+    """
+
+    async with AsyncYaDisk(token=yadisk_token) as disk:
+        meta = await disk.get_public_meta(link, limit=1000)
+    items = select_data_items(list(meta['embedded']['items']))
+    downloaded = await download_items(full_name, items, concurrency)
+    downloaded_names = {Path(i).name for i in downloaded}
+    manifest = SyncManifest(full_name)
+    manifest.entries = {
+        i['name']: make_manifest_entry(i)
+        for i in items
+        if i['name'] in downloaded_names
+    }
+    manifest.save()
+    return downloaded
@@ -6,3 +6,20 @@ function updateGraph() {
   }
   Plotly.relayout(document.getElementsByClassName("plotly-graph-div")[0].id, update);
 }
+
+function loadGraph(container) {
+  fetch(container.dataset.url)
+    .then(response => response.ok ? response.json() : null)
+    .then(figure => {
+      if (figure) {
+        Plotly.newPlot(container, figure.data, figure.layout, {responsive: true});
+      }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+  var containers = document.querySelectorAll('.plotly-graph-div[data-url]');
+  for (let i = 0; i < containers.length; i++) {
+    loadGraph(containers[i]);
+  }
+});
@@ -0,0 +1,59 @@
+import unittest
+
+from msu_aerosol.admin import get_poll_interval
+from msu_aerosol.config import poll_max_interval, poll_min_interval
+
+__all__: list = []
+
+
+class TestGetPollInterval(unittest.TestCase):
+    def test_changed_halves_interval(self):
+        self.assertEqual(
+            get_poll_interval(poll_min_interval * 4, True, None),
+            poll_min_interval * 2,
+        )
+
+    def test_unchanged_grows_interval(self):
+        self.assertEqual(
+            get_poll_interval(poll_min_interval * 2, False, None),
+            poll_min_interval * 3,
+        )
+
+    def test_bounds(self):
+        self.assertEqual(
+            get_poll_interval(poll_min_interval, True, None),
+            poll_min_interval,
+        )
+        self.assertEqual(
+            get_poll_interval(poll_max_interval, False, None),
+            poll_max_interval,
+        )
+
+    def test_upload_interval_caps_interval(self):
+        upload_interval = poll_min_interval * 3
+        self.assertEqual(
+            get_poll_interval(upload_interval, False, upload_interval),
+            upload_interval,
+        )
+        # Промежуток меньше нижней границы её не уменьшает
+        self.assertEqual(
+            get_poll_interval(poll_min_interval, False, 1),
+            poll_min_interval,
+        )
+
+    def test_idle_device_backs_off(self):
+        upload_interval = poll_min_interval * 3
+        interval = upload_interval
+        # Прибор не выгружал данные уже сутки
+        for _ in range(20):
+            interval = get_poll_interval(
+                interval,
+                False,
+                upload_interval,
+                24 * 60 * 60,
+            )
+        self.assertEqual(
+            interval,
+            min(poll_max_interval, 24 * 60 * 60),
+        )
+        self.assertGreater(interval, upload_interval)
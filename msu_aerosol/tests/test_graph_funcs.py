@@ -0,0 +1,681 @@
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import tempfile
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from app import app
+from msu_aerosol.exceptions import ColumnsMatchError
+from msu_aerosol.graph_funcs import (
+    clean_columns,
+    decimate,
+    detect_parse_settings,
+    encode_typed_arrays,
+    get_device_range,
+    make_figure,
+    parse_epoch,
+    parse_time_column,
+    preprocess_device_data,
+    preprocessing_one_file,
+    proc_spaces,
+    read_raw_file_slow,
+    refresh_device,
+    save_month_partition,
+    update_device_stats,
+)
+from msu_aerosol.models import (
+    db,
+    Device,
+    DeviceStats,
+    Graph,
+    ParseSettings,
+    TimeColumn,
+    VariableColumn,
+)
+from msu_aerosol.storage import CsvStorage, storages
+
+__all__: list = []
+
+
+class TestProcSpaces(unittest.TestCase):
+    def setUp(self) -> None:
+        timestamps = list(pd.date_range('2024-01-01', periods=5, freq='1min'))
+        timestamps += list(
+            pd.date_range('2024-01-01 01:00', periods=5, freq='1min'),
+        )
+        self.df = pd.DataFrame(
+            {
+                'timestamp': timestamps,
+                'value': [float(i) for i in range(10)],
+            },
+        )
+
+    def test_gap_markers(self):
+        result = proc_spaces(self.df, 'timestamp')
+        self.assertEqual(len(result), len(self.df) + 2)
+        markers = result.tail(2)
+        self.assertEqual(
+            list(markers['timestamp']),
+            [
+                pd.Timestamp('2024-01-01 00:04:01'),
+                pd.Timestamp('2024-01-01 00:59:59'),
+            ],
+        )
+        self.assertTrue(markers['value'].isna().all())
+
+    def test_no_gaps(self):
+        result = proc_spaces(self.df.iloc[:5], 'timestamp')
+        self.assertEqual(len(result), 5)
+
+    def test_unsorted_input(self):
+        result = proc_spaces(self.df.iloc[::-1], 'timestamp')
+        self.assertEqual(
+            list(result['timestamp'].iloc[:10]),
+            list(self.df['timestamp']),
+        )
+        self.assertEqual(len(result), len(self.df) + 2)
+
+    def test_gap_at_chunk_boundary(self):
+        result = proc_spaces(
+            self.df.iloc[5:],
+            'timestamp',
+            last_time=pd.Timestamp('2024-01-01 00:04'),
+        )
+        self.assertEqual(len(result), 7)
+        self.assertEqual(
+            list(result['timestamp'].tail(2)),
+            [
+                pd.Timestamp('2024-01-01 00:04:01'),
+                pd.Timestamp('2024-01-01 00:59:59'),
+            ],
+        )
+
+
+class TestCleanColumns(unittest.TestCase):
+    def test_clean_columns(self):
+        df = pd.DataFrame(
+            {
+                'time': [' 2024-01-01 10:00 ', '2024-01-01 10:01'],
+                'BC1': [' 1,5 ', ''],
+                'BC2': [1.0, 2.0],
+                'Status': [' ok ', None],
+            },
+        )
+        result = clean_columns(df, 'time')
+        self.assertEqual(
+            list(result['time']),
+            ['2024-01-01 10:00', '2024-01-01 10:01'],
+        )
+        self.assertEqual(result['BC1'].iloc[0], 1.5)
+        self.assertTrue(pd.isna(result['BC1'].iloc[1]))
+        self.assertIs(result['BC2'].dtype, df['BC2'].dtype)
+        self.assertEqual(result['Status'].iloc[0], 'ok')
+        self.assertIsNone(result['Status'].iloc[1])
+
+
+class TestDecimate(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range(
+                    '2024-01-01',
+                    periods=10000,
+                    freq='1s',
+                ),
+                'BC1': rng.random(10000),
+                'BC2': rng.random(10000),
+            },
+        )
+
+    def test_keeps_peaks_and_gaps(self):
+        self.df.loc[1234, 'BC1'] = 100
+        self.df.loc[4321, 'BC2'] = -100
+        self.df.loc[5000, ['BC1', 'BC2']] = np.nan
+        result = decimate(self.df, 'timestamp', ['BC1', 'BC2'], points=100)
+        self.assertIn(1234, result['BC1'].index)
+        self.assertIn(4321, result['BC2'].index)
+        for column, trace in result.items():
+            with self.subTest(column=column):
+                self.assertEqual(list(trace.columns), ['timestamp', column])
+                self.assertLessEqual(len(trace), 2 + 1 + 100)
+                self.assertIn(5000, trace.index)
+                self.assertEqual(trace.index[0], 0)
+                self.assertEqual(trace.index[-1], 9999)
+
+    def test_budget_per_line(self):
+        rng = np.random.default_rng(1)
+        columns = [f'BC{i}' for i in range(20)]
+        for column in columns:
+            self.df[column] = rng.random(len(self.df))
+        result = decimate(self.df, 'timestamp', columns, points=100)
+        self.assertLessEqual(max(len(i) for i in result.values()), 2 + 100)
+
+    def test_small_frame(self):
+        result = decimate(self.df, 'timestamp', ['BC1'], points=10000)
+        pd.testing.assert_frame_equal(
+            result['BC1'],
+            self.df[['timestamp', 'BC1']],
+        )
+
+
+class TestEncodeTypedArrays(unittest.TestCase):
+    def test_round_trip(self):
+        df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range(
+                    '2024-01-01 12:00',
+                    periods=3,
+                    freq='1min',
+                ),
+                'BC1': [1.5, np.nan, 3.25],
+            },
+        )
+        figure = encode_typed_arrays(
+            px.line(df, x='timestamp', y=['BC1']).to_plotly_json(),
+        )
+        trace = figure['data'][0]
+        self.assertEqual(trace['x']['dtype'], 'f8')
+        times = np.frombuffer(base64.b64decode(trace['x']['bdata']), '<f8')
+        self.assertEqual(
+            list(pd.to_datetime(times, unit='ms')),
+            list(df['timestamp']),
+        )
+        values = np.frombuffer(base64.b64decode(trace['y']['bdata']), '<f4')
+        np.testing.assert_array_equal(values, df['BC1'].to_numpy('f4'))
+        self.assertEqual(figure['layout']['xaxis']['type'], 'date')
+
+
+class TestMakeFigure(unittest.TestCase):
+    def test_traces(self):
+        graph = SimpleNamespace(
+            columns=[
+                SimpleNamespace(
+                    name=name,
+                    use=True,
+                    coefficient=coefficient,
+                    color=color,
+                    default=default,
+                )
+                for name, coefficient, color, default in (
+                    ('BC1', 1, '#ff0000', True),
+                    ('BCbb', 2, '#00ff00', False),
+                    ('BC2', 1, '#0000ff', True),
+                )
+            ],
+            time_columns=[SimpleNamespace(name='Datetime', use=True)],
+            device=SimpleNamespace(full_name='AE33 S1'),
+        )
+        df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range('2024-01-01', periods=3),
+                'BC1': [1.0, 2.0, 3.0],
+                'BCbb': [4.0, np.nan, 6.0],
+                'BC2': [0.0, 0.0, 0.0],
+            },
+        )
+        figure = make_figure(
+            graph,
+            {i: df[['timestamp', i]] for i in ('BCbb', 'BC1')},
+            'timestamp',
+            'scattergl',
+            14,
+        )
+        self.assertEqual(
+            [i['name'] for i in figure['data']],
+            ['BCbb * 2', 'BC1'],
+        )
+        trace = figure['data'][0]
+        self.assertEqual(trace['type'], 'scattergl')
+        self.assertEqual(trace['visible'], 'legendonly')
+        self.assertEqual(trace['line'], {'color': '#00ff00', 'width': 2})
+        self.assertEqual(trace['fill'], 'tozeroy')
+        np.testing.assert_array_equal(trace['y'], df['BCbb'])
+        self.assertEqual(figure['layout']['title']['text'], 'AE33 S1')
+        self.assertEqual(
+            figure['layout']['xaxis']['title']['text'],
+            'Datetime',
+        )
+
+
+class TestSaveMonthPartition(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range('2024-01-01', periods=6, freq='1h'),
+                'BC1': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                'BC2': [10.0, 20.0, 30.0, 40.0, 50.0, 60.0],
+            },
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def save(self, storage, df: pd.DataFrame, columns: list[str]) -> None:
+        with (
+            mock.patch(
+                'msu_aerosol.graph_funcs.get_storage',
+                return_value=storage,
+            ),
+            mock.patch.object(storage, 'append', wraps=storage.append),
+            mock.patch.object(storage, 'write', wraps=storage.write),
+        ):
+            save_month_partition(df.copy(), 'AE33', '2024_01', columns)
+            self.appended = storage.append.called
+            self.written = storage.write.called
+
+    def check(self, storage, expected: pd.DataFrame) -> None:
+        pd.testing.assert_frame_equal(
+            storage.read('AE33', '2024_01').copy(),
+            expected.reset_index(drop=True),
+            check_dtype=False,
+        )
+
+    def test_strictly_newer_rows_are_appended(self):
+        columns = list(self.df.columns)
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(f'{self.tmp.name}/{name}')
+                self.save(storage, self.df.head(3), columns)
+                self.save(storage, self.df.tail(3), columns)
+                self.assertTrue(self.appended)
+                self.check(storage, self.df)
+
+    def test_overlapping_rows_are_merged(self):
+        columns = list(self.df.columns)
+        new = self.df.iloc[2:].copy()
+        new.loc[2, 'BC1'] = 100.0
+        expected = self.df.copy()
+        expected.loc[2, 'BC1'] = 100.0
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(f'{self.tmp.name}/{name}')
+                self.save(storage, self.df.head(4), columns)
+                self.save(storage, new, columns)
+                self.assertFalse(self.appended)
+                self.assertTrue(self.written)
+                self.check(storage, expected)
+
+    def test_new_columns_are_merged(self):
+        expected = self.df.copy()
+        expected.loc[:2, 'BC2'] = np.nan
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(f'{self.tmp.name}/{name}')
+                self.save(
+                    storage,
+                    self.df.head(3)[['timestamp', 'BC1']],
+                    ['timestamp', 'BC1'],
+                )
+                self.save(storage, self.df.tail(3), list(self.df.columns))
+                self.assertFalse(self.appended)
+                self.assertTrue(self.written)
+                self.check(storage, expected)
+
+
+class TestDetectParseSettings(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def detect(self, filename: str, text: str) -> dict:
+        path = Path(self.tmp.name) / filename
+        path.write_text(text, encoding='utf-8')
+        return detect_parse_settings(str(path))
+
+    def test_semicolon_and_decimal_comma(self):
+        settings = self.detect(
+            'data.csv',
+            'Date;BC1;BC2\n01.02.2024 10:00;1,5;2,25\n',
+        )
+        self.assertEqual(settings['delimiter'], ';')
+        self.assertEqual(settings['decimal'], ',')
+        self.assertEqual(settings['header_row'], 0)
+        self.assertEqual(settings['columns'], ['Date', 'BC1', 'BC2'])
+
+    def test_comma_delimiter(self):
+        settings = self.detect(
+            'data.csv',
+            'Date,BC1,BC2\n2024-02-01 10:00,1.5,2.25\n',
+        )
+        self.assertEqual(settings['delimiter'], ',')
+        self.assertEqual(settings['decimal'], '.')
+
+    def test_txt_file(self):
+        settings = self.detect(
+            'data.txt',
+            'Instrument AE33\nDate\tBC1\n2024-02-01 10:00\t1.5\n',
+        )
+        self.assertEqual(settings['delimiter'], '\t')
+        self.assertEqual(settings['decimal'], '.')
+        self.assertEqual(settings['encoding'], 'latin')
+        self.assertEqual(settings['header_row'], 1)
+
+    def test_reads_only_file_start(self):
+        rows = ''.join(
+            f'2024-02-01 10:00:{i % 60:02d};{i},5\n' for i in range(10**5)
+        )
+        settings = self.detect('data.csv', f'Date;BC1\n{rows}')
+        self.assertEqual(settings['columns'], ['Date', 'BC1'])
+        self.assertEqual(settings['decimal'], ',')
+
+
+class TestParseTime(unittest.TestCase):
+    def test_epoch_seconds(self):
+        values = pd.Series([1709942400, 1709942460.25, 1710054000.5])
+        self.assertEqual(
+            list(parse_epoch(values)),
+            [datetime.fromtimestamp(i) for i in values],
+        )
+
+    def test_epoch_milliseconds(self):
+        values = pd.Series([1709942400000, 1709942460250])
+        self.assertEqual(
+            list(parse_epoch(values)),
+            [datetime.fromtimestamp(i / 1000) for i in values],
+        )
+
+    def test_epoch_with_empty_value(self):
+        with self.assertRaises(ValueError):
+            parse_epoch(pd.Series([1709942400, None]))
+
+    def test_graph_format(self):
+        values = pd.Series(['01.02.2024 10:00'])
+        times = parse_time_column(values, 1, 'd.m.Y H:M')
+        self.assertEqual(list(times), [pd.Timestamp('2024-02-01 10:00')])
+
+    def test_inferred_format(self):
+        values = pd.Series(['2024-02-01 10:00:05'])
+        times = parse_time_column(values, 2, 'Y/m/d')
+        self.assertEqual(list(times), [pd.Timestamp('2024-02-01 10:00:05')])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            parse_time_column(pd.Series(['not a date']), 3, 'Y/m/d')
+
+    def test_inferred_day_first_format(self):
+        times = parse_time_column(pd.Series(['01.02.2024 10:00']), 4, None)
+        self.assertEqual(list(times), [pd.Timestamp('2024-02-01 10:00')])
+
+
+class TestDeviceStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = CsvStorage(self.tmp.name)
+        self.app_context = app.app_context()
+        self.app_context.push()
+        # Прибор добавляется в обход ORM, чтобы не скачивать его данные
+        self.device_id = db.session.execute(
+            Device.__table__.insert().values(name='StatsTest', link='link'),
+        ).inserted_primary_key[0]
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        DeviceStats.query.filter_by(device_id=self.device_id).delete()
+        Device.query.filter_by(id=self.device_id).delete()
+        db.session.commit()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def write(self, partition: str, start: str) -> None:
+        self.storage.write(
+            'StatsTest',
+            partition,
+            pd.DataFrame(
+                {
+                    'timestamp': pd.date_range(start, periods=3, freq='1h'),
+                    'BC1': [1.0, 2.0, 3.0],
+                },
+            ),
+        )
+
+    def test_stats_follow_ingest(self):
+        with mock.patch(
+            'msu_aerosol.graph_funcs.get_storage',
+            return_value=self.storage,
+        ):
+            self.write('2024_01', '2024-01-31 20:00')
+            self.assertEqual(
+                get_device_range(self.device_id),
+                (
+                    pd.Timestamp('2024-01-31 20:00'),
+                    pd.Timestamp('2024-01-31 22:00'),
+                ),
+            )
+            # Без пред обработки границы берутся из БД, а не из разделов
+            self.write('2024_02', '2024-02-01 00:00')
+            self.assertEqual(
+                get_device_range(self.device_id)[1],
+                pd.Timestamp('2024-01-31 22:00'),
+            )
+            update_device_stats(self.device_id, 'StatsTest', ingested=True)
+
+        self.assertEqual(
+            get_device_range(self.device_id)[1],
+            pd.Timestamp('2024-02-01 02:00'),
+        )
+        stats = DeviceStats.query.filter_by(device_id=self.device_id).first()
+        self.assertEqual(stats.rows, 6)
+        self.assertIsNotNone(stats.last_ingest)
+        self.assertIsNone(stats.last_render)
+
+
+class TestPreprocessDeviceData(unittest.TestCase):
+    files = {
+        'a.csv': [
+            ('2024-01-31 22:00:00', '1.0', '10'),
+            ('2024-01-31 22:10:00', '2.0', '20'),
+            ('2024-01-31 22:20:00', '3.0', '30'),
+            ('2024-02-01 00:00:00', '4.0', '40'),
+            ('2024-02-01 00:10:00', '5.0', '50'),
+            ('2024-02-01 00:20:00', '6.0', '60'),
+        ],
+        # Повторяет часть времени из a.csv, одно значение пропущено
+        'b.csv': [
+            ('2024-02-01 00:10:00', '7.0', ''),
+            ('2024-02-01 00:20:00', '8.0', '80'),
+            ('2024-02-01 00:30:00', '9.0', '90'),
+        ],
+        # Возвращается к уже записанному январскому разделу
+        'c.csv': [
+            ('2024-01-31 22:10:00', '', '200'),
+            ('2024-02-01 00:40:00', '10.0', '100'),
+            ('2024-02-01 00:50:00', '11.0', '110'),
+        ],
+    }
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        data = Path(self.tmp.name) / 'data' / 'BatchTest'
+        data.mkdir(parents=True)
+        for name, rows in self.files.items():
+            lines = ['Datetime,BC1,BC2'] + [','.join(i) for i in rows]
+            (data / name).write_text('\n'.join(lines) + '\n')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        # Записи добавляются в обход ORM, чтобы не скачивать данные прибора
+        self.device_id = db.session.execute(
+            Device.__table__.insert().values(
+                name='BatchTest',
+                full_name='BatchTest',
+                link='link',
+            ),
+        ).inserted_primary_key[0]
+        self.graph_id = db.session.execute(
+            Graph.__table__.insert().values(
+                name='BatchTest',
+                device_id=self.device_id,
+            ),
+        ).inserted_primary_key[0]
+        db.session.execute(
+            VariableColumn.__table__.insert(),
+            [
+                {'name': i, 'use': True, 'graph_id': self.graph_id}
+                for i in ('BC1', 'BC2')
+            ],
+        )
+        db.session.execute(
+            TimeColumn.__table__.insert().values(
+                name='Datetime',
+                use=True,
+                graph_id=self.graph_id,
+            ),
+        )
+        db.session.commit()
+        patcher = mock.patch(
+            'msu_aerosol.graph_funcs.main_path',
+            str(data.parent),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        for model in (VariableColumn, TimeColumn):
+            model.query.filter_by(graph_id=self.graph_id).delete()
+        Graph.query.filter_by(id=self.graph_id).delete()
+        for model in (DeviceStats, ParseSettings):
+            model.query.filter_by(device_id=self.device_id).delete()
+        Device.query.filter_by(id=self.device_id).delete()
+        db.session.commit()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def ingest(self, batch: bool) -> CsvStorage:
+        storage = CsvStorage(f'{self.tmp.name}/proc_{batch}')
+        graph = Graph.query.filter_by(id=self.graph_id).first()
+        with (
+            mock.patch(
+                'msu_aerosol.graph_funcs.get_storage',
+                return_value=storage,
+            ),
+            mock.patch(
+                'msu_aerosol.rollups.get_storage',
+                return_value=storage,
+            ),
+        ):
+            if batch:
+                preprocess_device_data('BatchTest', graph)
+            else:
+                for name in self.files:
+                    preprocessing_one_file(
+                        graph,
+                        f'{self.tmp.name}/data/BatchTest/{name}',
+                    )
+        return storage
+
+    def test_batch_matches_sequential(self):
+        self.check_batch(self.ingest(True))
+
+    def test_row_limit_matches_sequential(self):
+        # Все файлы считаются большими, буфер записывается после каждой части
+        with mock.patch('msu_aerosol.graph_funcs.ingest_chunk_rows', 2):
+            self.check_batch(self.ingest(True))
+
+    def test_pool_matches_sequential(self):
+        with (
+            ProcessPoolExecutor(1) as pool,
+            mock.patch('msu_aerosol.graph_funcs.refresh_pool', pool),
+        ):
+            self.check_batch(self.ingest(True))
+
+    def check_batch(self, batch: CsvStorage) -> None:
+        sequential = self.ingest(False)
+        self.assertEqual(
+            batch.partitions('BatchTest'),
+            ['2024_01', '2024_02'],
+        )
+        for partition in batch.partitions('BatchTest'):
+            with self.subTest(partition=partition):
+                pd.testing.assert_frame_equal(
+                    batch.read('BatchTest', partition),
+                    sequential.read('BatchTest', partition),
+                )
+        january = batch.read('BatchTest', '2024_01').set_index('timestamp')
+        row = january.loc[pd.Timestamp('2024-01-31 22:10')]
+        self.assertEqual((row['BC1'], row['BC2']), (2.0, 200.0))
+        february = batch.read('BatchTest', '2024_02').set_index('timestamp')
+        row = february.loc[pd.Timestamp('2024-02-01 00:10')]
+        self.assertEqual((row['BC1'], row['BC2']), (7.0, 50.0))
+
+    def ingest_file(self, name: str, text: str) -> CsvStorage:
+        """
+        Пред обработка одного файла после файлов из files,
+        по которым сохранены параметры чтения
+        """
+        storage = self.ingest(False)
+        path = Path(self.tmp.name) / 'data' / 'BatchTest' / name
+        path.write_text(text)
+        graph = Graph.query.filter_by(id=self.graph_id).first()
+        with (
+            mock.patch(
+                'msu_aerosol.graph_funcs.get_storage',
+                return_value=storage,
+            ),
+            mock.patch(
+                'msu_aerosol.rollups.get_storage',
+                return_value=storage,
+            ),
+        ):
+            preprocessing_one_file(graph, str(path))
+        return storage
+
+    def test_missing_column_is_not_reread(self):
+        with (
+            mock.patch(
+                'msu_aerosol.graph_funcs.read_raw_file_slow',
+                wraps=read_raw_file_slow,
+            ) as slow,
+            self.assertRaises(ColumnsMatchError),
+        ):
+            self.ingest_file('d.csv', 'Datetime,BC1\n2024-03-01,1.0\n')
+        slow.assert_not_called()
+        self.assertIsNotNone(
+            ParseSettings.query.filter_by(device_id=self.device_id).first(),
+        )
+
+    def test_changed_delimiter_is_reread(self):
+        storage = self.ingest_file(
+            'd.csv',
+            'Datetime;BC1;BC2\n2024-03-01 00:00:00;1,5;10\n',
+        )
+        self.assertEqual(
+            list(storage.read('BatchTest', '2024_03')['BC1']),
+            [1.5],
+        )
+        self.assertIsNone(
+            ParseSettings.query.filter_by(device_id=self.device_id).first(),
+        )
+
+
+class TestRefreshDevice(unittest.TestCase):
+    def test_failure_is_not_new_data(self):
+        with (
+            mock.patch(
+                'msu_aerosol.graph_funcs.sync_device',
+                return_value=['data/AE33/a.csv'],
+            ),
+            mock.patch('msu_aerosol.graph_funcs.refresh_pool', None),
+            mock.patch(
+                'msu_aerosol.graph_funcs.update_device_graphs',
+                side_effect=ValueError,
+            ),
+            self.assertLogs('msu_aerosol.graph_funcs', 'ERROR'),
+        ):
+            self.assertFalse(refresh_device('AE33', 'link'))
+
+    def test_no_new_files(self):
+        with mock.patch(
+            'msu_aerosol.graph_funcs.sync_device',
+            return_value=[],
+        ):
+            self.assertFalse(refresh_device('AE33', 'link'))
@@ -0,0 +1,188 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from msu_aerosol.graph_funcs import proc_spaces
+from msu_aerosol.rollups import (
+    choose_level,
+    coarsen_rollup,
+    level_name,
+    make_rollup,
+    read_rollup,
+    rollup_levels,
+    sampling_step,
+    update_rollups,
+)
+from msu_aerosol.storage import storages
+
+__all__: list = []
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range(
+                    '2024-01-01',
+                    periods=3 * 24 * 60,
+                    freq='1min',
+                ),
+                'BC1': rng.random(3 * 24 * 60),
+            },
+        )
+        df.loc[100, 'BC1'] = 50
+        # Прибор не работал три часа
+        self.outage = df['timestamp'].iloc[[2000, 2181]].to_list()
+        df = df.drop(index=range(2001, 2181))
+        # Метки разрыва ставятся так же, как при пред обработке
+        self.df = proc_spaces(df, 'timestamp').sort_values(
+            by='timestamp',
+            ignore_index=True,
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_coarsen_matches_direct_rollup(self):
+        fine = make_rollup(self.df, rollup_levels['10min'])
+        coarse = coarsen_rollup(fine, rollup_levels['1h'])
+        pd.testing.assert_frame_equal(
+            coarse,
+            make_rollup(self.df, rollup_levels['1h']),
+            check_dtype=False,
+        )
+        self.assertEqual(coarse['BC1_max'].max(), 50)
+        self.assertEqual(
+            coarse['BC1_count'].sum(),
+            self.df['BC1'].notna().sum(),
+        )
+
+    def test_gap_breaks_line(self):
+        storage = storages['csv'](self.tmp.name)
+        storage.write('AE33', '2024_01', self.df)
+        update_rollups('AE33', storage)
+        begin, end = self.outage
+        for level in ('1min', '10min', '1h'):
+            with self.subTest(level=level):
+                step = rollup_levels[level]
+                df = read_rollup('AE33', level, begin, end, storage)
+                inside = df[
+                    (df['timestamp'] >= begin.floor(step) + step)
+                    & (df['timestamp'] < end.floor(step))
+                ]
+                self.assertFalse(inside.empty)
+                self.assertTrue(inside['BC1'].isna().all())
+
+    def test_choose_level(self):
+        end = pd.Timestamp('2024-12-31')
+        self.assertIsNone(choose_level(end - pd.Timedelta(days=2), end, 4000))
+        self.assertEqual(
+            choose_level(end - pd.Timedelta(days=14), end, 4000),
+            '1min',
+        )
+        self.assertEqual(
+            choose_level(end - pd.Timedelta(days=365), end, 4000),
+            '1h',
+        )
+        # Огибающая минутного уровня вдвое больше минутных данных
+        minute = pd.Timedelta(minutes=1)
+        self.assertIsNone(
+            choose_level(end - pd.Timedelta(days=14), end, 4000, minute),
+        )
+        self.assertEqual(
+            choose_level(end - pd.Timedelta(days=365), end, 4000, minute),
+            '1h',
+        )
+        self.assertEqual(
+            choose_level(
+                end - pd.Timedelta(days=14),
+                end,
+                4000,
+                pd.Timedelta(seconds=1),
+            ),
+            '1min',
+        )
+
+    def test_sampling_step(self):
+        storage = storages['csv'](self.tmp.name)
+        self.assertIsNone(sampling_step('AE33', storage))
+        storage.write('AE33', '2024_01', self.df)
+        self.assertAlmostEqual(
+            sampling_step('AE33', storage) / pd.Timedelta(minutes=1),
+            1,
+            delta=0.1,
+        )
+
+    def test_update_only_changed_partitions(self):
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df)
+                storage.write(name, '2024_02', self.df.tail(10))
+                update_rollups(name, storage)
+                storage.remove(name, '2024_02')
+                appended = self.df.tail(1).copy()
+                appended['timestamp'] += pd.Timedelta(hours=1)
+                storage.append(name, '2024_01', appended)
+                update_rollups(name, storage)
+                self.assertEqual(
+                    storage.partitions(level_name(name, '1h')),
+                    ['2024_01'],
+                )
+                df = read_rollup(
+                    name,
+                    '1h',
+                    self.df['timestamp'].iloc[0],
+                    appended['timestamp'].iloc[0],
+                    storage,
+                )
+                self.assertEqual(df['BC1'].max(), 50)
+                self.assertEqual(
+                    df['timestamp'].iloc[-1],
+                    appended['timestamp'].iloc[0].floor('1h')
+                    + pd.Timedelta(minutes=30),
+                )
+
+    def test_append_matches_rebuild(self):
+        # Части разрезают часовой промежуток и начало перерыва
+        marker = self.df.index[self.df['BC1'].isna()][0]
+        parts = (
+            slice(0, 1030),
+            slice(1030, marker + 1),
+            slice(marker + 1, None),
+        )
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df[parts[0]])
+                update_rollups(name, storage)
+                for part in parts[1:]:
+                    storage.append(name, '2024_01', self.df[part])
+                    with mock.patch(
+                        'msu_aerosol.rollups.make_rollup',
+                        wraps=make_rollup,
+                    ) as rollup:
+                        update_rollups(name, storage)
+                    # Агрегируются только дописанные строки
+                    self.assertEqual(
+                        {len(i.args[0]) for i in rollup.mock_calls},
+                        {len(self.df[part])},
+                    )
+                rollup = None
+                for level, step in rollup_levels.items():
+                    rollup = (
+                        make_rollup(self.df, step)
+                        if rollup is None
+                        else coarsen_rollup(rollup, step)
+                    )
+                    stored = storage.read(level_name(name, level), '2024_01')
+                    pd.testing.assert_frame_equal(
+                        stored.copy(),
+                        rollup,
+                        check_dtype=False,
+                    )
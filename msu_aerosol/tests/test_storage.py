@@ -0,0 +1,149 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from msu_aerosol.storage import NpyStorage, storages
+
+__all__: list = []
+
+
+class TestPartitionStorage(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range('2024-01-01', periods=5, freq='1h'),
+                'BC1': [1.5, 2.0, None, 4.0, 5.0],
+                'BC2': [1, 2, 3, 4, 5],
+            },
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df)
+                self.assertEqual(storage.partitions(name), ['2024_01'])
+                pd.testing.assert_frame_equal(
+                    storage.read(name, '2024_01').copy(),
+                    self.df,
+                    check_dtype=False,
+                )
+
+    def test_bounds_and_append(self):
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df.head(3))
+                storage.append(name, '2024_01', self.df.tail(2))
+                self.assertEqual(
+                    storage.bounds(name, '2024_01'),
+                    (list(self.df.columns), self.df['timestamp'].iloc[-1]),
+                )
+                self.assertEqual(len(storage.read(name, '2024_01')), 5)
+                storage.remove(name, '2024_01')
+                self.assertFalse(storage.exists(name, '2024_01'))
+
+    def test_read_tail(self):
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df)
+                for start in (0, 2, 4):
+                    pd.testing.assert_frame_equal(
+                        storage.read_tail(name, '2024_01', start).copy(),
+                        self.df.iloc[start:],
+                        check_dtype=False,
+                    )
+
+    def test_manifest_and_range_read(self):
+        for name, storage_class in storages.items():
+            with self.subTest(storage=name):
+                storage = storage_class(self.tmp.name)
+                storage.write(name, '2024_01', self.df.head(3))
+                write_id = storage.manifest(name)['2024_01']['write_id']
+                storage.append(name, '2024_01', self.df.tail(2))
+                self.assertEqual(
+                    storage.manifest(name),
+                    {
+                        '2024_01': {
+                            'min': '2024-01-01T00:00:00',
+                            'max': '2024-01-01T04:00:00',
+                            'rows': 5,
+                            'write_id': write_id,
+                        },
+                    },
+                )
+                result = storage.read_range(
+                    name,
+                    pd.Timestamp('2024-01-01 01:00'),
+                    pd.Timestamp('2024-01-01 02:00'),
+                )
+                self.assertEqual(list(result['BC2']), [2, 3])
+                self.assertTrue(
+                    storage.read_range(
+                        name,
+                        pd.Timestamp('2024-02-01'),
+                        pd.Timestamp('2024-03-01'),
+                    ).empty,
+                )
+
+
+class TestNpyAppend(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = NpyStorage(self.tmp.name)
+        self.df = pd.DataFrame(
+            {
+                'timestamp': pd.date_range('2024-01-01', periods=6, freq='1h'),
+                'BC1': [1.5, 2.0, None, 4.0, 5.0, 6.0],
+                'BC2': [1, 2, 3, 4, 5, 6],
+            },
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def append(self, df: pd.DataFrame) -> bool:
+        """
+        Дописывание строк; возвращает, был ли раздел перезаписан
+        """
+        with mock.patch.object(
+            self.storage,
+            'write',
+            wraps=self.storage.write,
+        ) as write:
+            self.storage.append('AE33', '2024_01', df)
+        return write.called
+
+    def test_append_in_place(self):
+        self.storage.write('AE33', '2024_01', self.df.head(2))
+        self.assertFalse(self.append(self.df.iloc[2:4]))
+        self.assertFalse(self.append(self.df.tail(2)))
+        pd.testing.assert_frame_equal(
+            self.storage.read('AE33', '2024_01').copy(),
+            self.df,
+        )
+        self.assertEqual(
+            self.storage.bounds('AE33', '2024_01')[1],
+            self.df['timestamp'].iloc[-1],
+        )
+        self.assertEqual(
+            self.storage.manifest('AE33')['2024_01']['rows'],
+            len(self.df),
+        )
+
+    def test_incompatible_type_rewrites_partition(self):
+        self.storage.write('AE33', '2024_01', self.df.head(3))
+        tail = self.df.tail(3).copy()
+        tail['BC2'] = [4.5, 5.5, 6.5]
+        self.assertTrue(self.append(tail))
+        self.assertEqual(
+            list(self.storage.read('AE33', '2024_01')['BC2']),
+            [1, 2, 3, 4.5, 5.5, 6.5],
+        )
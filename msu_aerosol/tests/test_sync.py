@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from msu_aerosol.sync import (
+    download_items,
+    make_manifest_entry,
+    sync_device,
+    SyncManifest,
+)
+
+__all__: list = []
+
+
+def make_item(name: str, size: int, md5: str, hour: int) -> dict:
+    return {
+        'name': name,
+        'size': size,
+        'md5': md5,
+        'sha256': md5 * 2,
+        'modified': datetime(2024, 1, 1, hour),
+        'file': f'https://example.com/{name}',
+    }
+
+
+class TestSyncDevice(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = Path(self.tmp.name) / 'data'
+        (self.data / 'AE33').mkdir(parents=True)
+        self.items = [
+            make_item('a.csv', 3, 'aaa', 1),
+            make_item('b.csv', 4, 'bbb', 2),
+        ]
+        for patcher in (
+            mock.patch('msu_aerosol.sync.main_path', str(self.data)),
+            mock.patch(
+                'msu_aerosol.sync.manifests_path',
+                str(Path(self.tmp.name) / 'manifests'),
+            ),
+            mock.patch(
+                'msu_aerosol.sync.get_remote_items',
+                return_value=self.items,
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.download = mock.AsyncMock(
+            side_effect=lambda name, items: [
+                str(self.data / name / i['name']) for i in items
+            ],
+        )
+        patcher = mock.patch('msu_aerosol.sync.download_items', self.download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def save_manifest(self, items: list) -> None:
+        manifest = SyncManifest('AE33')
+        manifest.entries = {i['name']: make_manifest_entry(i) for i in items}
+        manifest.save()
+
+    def test_unchanged_listing_is_skipped(self):
+        self.save_manifest(self.items)
+        self.assertEqual(sync_device('AE33', 'link'), [])
+        self.download.assert_not_called()
+
+    def test_local_file_of_same_size_is_adopted(self):
+        (self.data / 'AE33' / 'a.csv').write_bytes(b'123')
+        sync_device('AE33', 'link')
+        self.assertEqual(
+            [i['name'] for i in self.download.call_args.args[1]],
+            ['b.csv'],
+        )
+        self.assertEqual(
+            SyncManifest('AE33').entries,
+            {i['name']: make_manifest_entry(i) for i in self.items},
+        )
+
+    def test_failed_download_keeps_old_entry(self):
+        old = make_item('a.csv', 2, 'old', 0)
+        self.save_manifest([old])
+        self.download.side_effect = lambda name, items: [
+            str(self.data / name / 'b.csv'),
+        ]
+        self.assertEqual(
+            sync_device('AE33', 'link'),
+            [str(self.data / 'AE33' / 'b.csv')],
+        )
+        self.assertEqual(
+            SyncManifest('AE33').entries,
+            {
+                'a.csv': make_manifest_entry(old),
+                'b.csv': make_manifest_entry(self.items[1]),
+            },
+        )
+
+    def test_idle_time(self):
+        self.assertIsNone(SyncManifest('AE33').idle_time())
+        self.save_manifest(self.items)
+        self.assertAlmostEqual(
+            SyncManifest('AE33').idle_time(),
+            (datetime.now() - datetime(2024, 1, 1, 2)).total_seconds(),
+            delta=60,
+        )
+
+
+class FakeDisk:
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        return None
+
+    async def download_by_link(self, link: str, path: str) -> None:
+        Path(path).write_bytes(b'1234')
+        if link.endswith('a.csv'):
+            raise OSError('disk full')
+
+
+class TestDownloadItems(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch('msu_aerosol.sync.main_path', self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_failed_file_does_not_cancel_others(self):
+        items = [
+            make_item('a.csv', 4, 'aaa', 1),
+            make_item('b.csv', 4, 'bbb', 2),
+        ]
+        with (
+            mock.patch('msu_aerosol.sync.AsyncYaDisk', FakeDisk),
+            self.assertLogs('msu_aerosol.sync', 'ERROR'),
+        ):
+            paths = asyncio.run(download_items('AE33', items))
+        self.assertEqual(paths, [f'{self.tmp.name}/AE33/b.csv'])
+        self.assertEqual(
+            sorted(i.name for i in (Path(self.tmp.name) / 'AE33').iterdir()),
+            ['b.csv'],
+        )
@@ -1,9 +1,14 @@
+import gzip
 from http import HTTPStatus
+import json
 import unittest
 
 from flask import request, url_for
+import plotly.graph_objects as go
 
 from app import app
+from msu_aerosol.graph_funcs import graph_data_path, save_graph_data
+from msu_aerosol.models import db, Graph
 
 __all__: list = []
 
@@ -55,3 +60,66 @@ class TestStaticURL(unittest.TestCase):
             response = self.client.get(url_for('profile'))
 
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class TestGraphData(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        # График добавляется в обход ORM, чтобы не строить его по данным
+        self.graph_id = db.session.execute(
+            Graph.__table__.insert().values(name='DataTest'),
+        ).inserted_primary_key[0]
+        db.session.commit()
+        save_graph_data(
+            go.Figure(
+                go.Scatter(
+                    x=['2024-01-01', '2024-01-02'],
+                    y=[3, 4],
+                    name='BC1',
+                ),
+            ).to_plotly_json(),
+            'DataTest',
+            'full',
+        )
+        self.client = app.test_client()
+
+    def tearDown(self):
+        path = graph_data_path('DataTest', 'full')
+        path.unlink(missing_ok=True)
+        path.with_name(f'{path.name}.gz').unlink(missing_ok=True)
+        Graph.query.filter_by(id=self.graph_id).delete()
+        db.session.commit()
+        self.app_context.pop()
+
+    def test_plain_and_compressed(self):
+        with app.test_request_context():
+            url = url_for('graph_data', graph_id=self.graph_id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.data)['data'][0]['name'], 'BC1')
+        compressed = self.client.get(
+            url,
+            headers={'Accept-Encoding': 'gzip'},
+        )
+        self.assertEqual(compressed.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), response.data)
+        cached = self.client.get(
+            url,
+            headers={'If-None-Match': response.headers['ETag']},
+        )
+        self.assertEqual(cached.status_code, HTTPStatus.NOT_MODIFIED)
+        for i in (response, compressed, cached):
+            i.close()
+
+    def test_not_rendered(self):
+        with app.test_request_context():
+            url = url_for(
+                'graph_data',
+                graph_id=self.graph_id,
+                window='recent',
+            )
+        self.assertEqual(
+            self.client.get(url).status_code,
+            HTTPStatus.NOT_FOUND,
+        )
@@ -16,8 +16,15 @@ from forms.file_form import FileForm
 from msu_aerosol.admin import get_complexes_dict
 from msu_aerosol.config import allowed_extensions, upload_folder
 from msu_aerosol.exceptions import FileExtensionError
-from msu_aerosol.graph_funcs import choose_range, preprocessing_one_file
-from msu_aerosol.graph_funcs import make_graph
+from msu_aerosol.graph_funcs import (
+    choose_range,
+    get_device_range,
+    graph_data_path,
+    make_device_graphs,
+    make_graph,
+    preprocessing_one_file,
+    render_windows,
+)
 from msu_aerosol.models import Complex, Device, Graph
 
 __all__: list = []
@@ -41,7 +48,8 @@ def get_device_template(graph_id: int, **kwargs) -> str:
     complex_orm_obj = Complex.query.get_or_404(graph_orm_obj.device.complex_id)
     complex_to_graphs = get_complexes_dict()
     device_to_name = {dev.name: dev.full_name for dev in Device.query.all()}
-    min_date, max_date = choose_range(Graph.query.get(graph_id))
+    min_date, max_date = choose_range(graph_orm_obj)
+    first_date = get_device_range(graph_orm_obj.device_id)[0]
     return render_template(
         'device/device.html',
         now=datetime.now(),
@@ -51,6 +59,7 @@ def get_device_template(graph_id: int, **kwargs) -> str:
         complex_to_graphs=complex_to_graphs,
         user=current_user,
         device_to_name=device_to_name,
+        first_date=str(first_date).replace(' ', 'T'),
         min_date=str(min_date).replace(' ', 'T'),
         max_date=str(max_date).replace(' ', 'T'),
         message=message,
@@ -110,8 +119,7 @@ class GraphPage(MethodView):
                     str(Path(directory) / filename),
                     user_upload=True,
                 )
-                make_graph(graph, 'full')
-                make_graph(graph, 'recent')
+                make_device_graphs([graph])
                 return get_device_template(
                     graph_id,
                     message='Файл успешно получен',
@@ -169,3 +177,45 @@ class GraphDownload(MethodView):
             ),
             mimetype='text/csv',
         )
+
+
+class GraphData(MethodView):
+    """
+    Представление данных отрисованного графика.
+    Отдаёт json с данными и макетом графика, который строится в браузере.
+    Данные кешируются браузером и отдаются сжатыми, если он это умеет.
+    """
+
+    def get(self, graph_id: int) -> Response:
+        """
+        Метод GET, только он доступен.
+
+        :param graph_id: Идентификатор графика
+        :return: json графика (full или recent из параметра window)
+        """
+
+        graph = Graph.query.get_or_404(graph_id)
+        spec_act = request.args.get('window', 'full')
+        if spec_act not in render_windows:
+            abort(404)
+        path = graph_data_path(graph.name, spec_act).resolve()
+        compressed = path.with_name(f'{path.name}.gz')
+        if 'gzip' in request.accept_encodings and compressed.exists():
+            response = send_file(
+                compressed,
+                mimetype='application/json',
+                conditional=True,
+                max_age=60,
+            )
+            response.content_encoding = 'gzip'
+        elif path.exists():
+            response = send_file(
+                path,
+                mimetype='application/json',
+                conditional=True,
+                max_age=60,
+            )
+        else:
+            abort(404)
+        response.vary.add('Accept-Encoding')
+        return response